@@ -5,6 +5,8 @@
 
 import os
 import re
+import sys
+import argparse
 import time
 import json
 import sqlite3
@@ -13,8 +15,18 @@ import random
 import tempfile
 import subprocess
 import shutil
-from datetime import datetime, timezone
-from typing import Optional, Dict, Any, List, Iterable
+import mmap
+import gzip
+import hashlib
+import io
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone, date, timedelta
+from typing import Optional, Dict, Any, List, Iterable, Tuple
 from urllib.parse import urlparse
 from pathlib import Path
 from html import escape
@@ -23,6 +35,17 @@ import requests
 from jinja2 import Template
 from unidecode import unidecode
 
+try:
+    import brotli  # optional: only needed for .br sidecars
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image, features as pil_features  # optional: only needed for WebP/AVIF poster variants
+except ImportError:
+    Image = None
+    pil_features = None
+
 # ---------------------------
 # CONFIG
 # ---------------------------
@@ -38,20 +61,227 @@ DB_PATH = os.environ.get('DB_PATH', 'published_items.db')        # table 'publis
 IMDB_DB_PATH = os.environ.get('IMDB_DB_PATH', 'imdb_queue.db')   # bootstrap/updater DB with table 'imdb_queue' (status field)
 
 IMDB_FILE = os.environ.get('IMDB_FILE', 'imdb_ids.txt')  # file produced by bootstrap_imdb_list.py
+# byte-offset cursor into IMDB_FILE so a restart resumes mid-file ({"offset": n, "inode": i})
+IMDB_QUEUE_CURSOR_FILE = os.environ.get('IMDB_QUEUE_CURSOR_FILE', IMDB_FILE + '.cursor.json')
+# size of the per-pass dedupe bitmap, indexed by the numeric part of the tt id (8 MiB by default)
+QUEUE_DEDUPE_BITS = int(os.environ.get('QUEUE_DEDUPE_BITS', str(1 << 26)))
+
+# Ongoing-series refresh driven by TMDB /tv/changes (cursor persisted like fetch_progress.json)
+REFRESH_ONGOING = os.environ.get('REFRESH_ONGOING', '1') == '1'
+TV_CHANGES_PROGRESS_FILE = os.environ.get('TV_CHANGES_PROGRESS_FILE', 'tv_changes_progress.json')
+TV_CHANGES_MAX_WINDOW_DAYS = 14  # TMDB rejects change queries spanning more than 14 days
+
+# Built-in discovery: pages TMDB /discover by release-date window from a persisted cursor, resolves
+# IMDb ids concurrently and upserts new titles into imdb_queue (+ appends released ones to IMDB_FILE)
+DISCOVER = os.environ.get('DISCOVER', '1') == '1'
+DISCOVER_PROGRESS_FILE = os.environ.get('DISCOVER_PROGRESS_FILE', 'discover_progress.json')
+DISCOVER_TYPES = [x.strip() for x in os.environ.get('DISCOVER_TYPES', 'movie').split(',') if x.strip() in ('movie', 'tv')]
+DISCOVER_WINDOW_DAYS = int(os.environ.get('DISCOVER_WINDOW_DAYS', '7'))
+DISCOVER_OVERLAP_DAYS = int(os.environ.get('DISCOVER_OVERLAP_DAYS', '3'))  # TMDB entries often appear a few days late
+DISCOVER_INTERVAL_HOURS = float(os.environ.get('DISCOVER_INTERVAL_HOURS', '6'))
+DISCOVER_RETRY_MINUTES = float(os.environ.get('DISCOVER_RETRY_MINUTES', '5'))  # first backoff after a failed run; doubles up to the interval
+DISCOVER_MIN_VOTE_COUNT = int(os.environ.get('DISCOVER_MIN_VOTE_COUNT', '0'))
+DISCOVER_MAX_PAGES = 500  # TMDB refuses discover pages beyond 500
+DISCOVER_WORKERS = int(os.environ.get('DISCOVER_WORKERS', '4'))
+
+# Seasons whose episodes have all aired are cached for good; others are refetched after this many hours
+SEASON_CACHE_TTL_HOURS = int(os.environ.get('SEASON_CACHE_TTL_HOURS', '24'))
+SCHEDULE_RETRY_HOURS = float(os.environ.get('SCHEDULE_RETRY_HOURS', '1'))  # after a due episode fails to publish; doubles per attempt
+SCHEDULE_MAX_ATTEMPTS = int(os.environ.get('SCHEDULE_MAX_ATTEMPTS', '6'))  # then the schedule row is dropped
+SEASON_WORKERS = int(os.environ.get('SEASON_WORKERS', '8'))  # concurrent season fetches while preparing a series
+
+# Shared TMDB request-rate governor: a token bucket in a SQLite file that every publisher/bootstrap
+# process on the host consults; the rate adapts AIMD-style (additive increase on fast successes,
+# multiplicative decrease on 429s or slow responses) between TMDB_RATE_MIN and TMDB_RATE_MAX req/s
+TMDB_RATE_GOVERNOR = os.environ.get('TMDB_RATE_GOVERNOR', '1') == '1'
+TMDB_RATE_DB = os.environ.get('TMDB_RATE_DB', 'tmdb_rate.db')
+TMDB_RATE_MIN = float(os.environ.get('TMDB_RATE_MIN', '1'))
+TMDB_RATE_MAX = float(os.environ.get('TMDB_RATE_MAX', '40'))
+TMDB_RATE_BURST = float(os.environ.get('TMDB_RATE_BURST', '10'))
+TMDB_RATE_STEP = float(os.environ.get('TMDB_RATE_STEP', '0.2'))        # req/s added per fast success
+TMDB_RATE_BACKOFF = float(os.environ.get('TMDB_RATE_BACKOFF', '0.5'))  # rate multiplier on 429
+TMDB_LATENCY_TARGET_MS = float(os.environ.get('TMDB_LATENCY_TARGET_MS', '1500'))
+TMDB_MAX_RETRIES = int(os.environ.get('TMDB_MAX_RETRIES', '3'))
 
 # Rate bounds (in seconds) for random sleep after successful publish
 RATE_MIN = int(os.environ.get('RATE_MIN', '130'))
 RATE_MAX = int(os.environ.get('RATE_MAX', '260'))
 
+# Precompressed sidecars written next to every page (comma list of 'gz', 'br'; empty disables).
+# nginx gzip_static/brotli_static and most CDNs serve these without compressing per request.
+PRECOMPRESS = [x.strip().lower() for x in os.environ.get('PRECOMPRESS', '').split(',') if x.strip()]
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '9'))
+BROTLI_LEVEL = int(os.environ.get('BROTLI_LEVEL', '11'))
+COMPRESS_WORKERS = int(os.environ.get('COMPRESS_WORKERS', '2'))
+
+# Group-commit page writer for bulk work (re-renders, reshard): pages are written in
+# batches of WRITE_BATCH_SIZE from WRITE_WORKERS threads and become visible all together (see PageBatch).
+# FSYNC_MODE: 'batch' fsyncs every file and directory of a batch once, as a group, before and after
+# publishing it (durable once commit() returns); 'off' skips fsync (still all-or-nothing if the process
+# dies, but a power loss can drop a recently committed batch).
+FSYNC_MODE = os.environ.get('FSYNC_MODE', 'batch')
+WRITE_WORKERS = int(os.environ.get('WRITE_WORKERS', '4'))
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', '50'))
+# opt-in: also group the episodes of the live publish loop into WRITE_BATCH_SIZE batches, with one publish
+# sleep per batch. Off (default), each episode is written, pushed and paced (RATE_MIN/RATE_MAX) on its own.
+BATCH_LIVE_EPISODES = os.environ.get('BATCH_LIVE_EPISODES', '0') == '1'
+
+# Post-render stage: minify HTML / inline JSON-LD and link the invariant JS from a hashed shared asset
+MINIFY_HTML = os.environ.get('MINIFY_HTML', '1') == '1'
+SHARED_ASSETS = os.environ.get('SHARED_ASSETS', '1') == '1'
+ASSETS_SUBDIR = os.environ.get('ASSETS_SUBDIR', 'assets')  # relative to SITE_DIR
+
+# Poster images: each TMDB poster is fetched once into a content-addressed cache and served from
+# SITE_DIR as responsive WebP/AVIF variants (point TMDB_IMAGE_BASE at a local server to test)
+POSTER_CACHE = os.environ.get('POSTER_CACHE', '1') == '1'
+TMDB_IMAGE_BASE = os.environ.get('TMDB_IMAGE_BASE', 'https://image.tmdb.org/t/p').rstrip('/')
+POSTER_SOURCE_SIZE = os.environ.get('POSTER_SOURCE_SIZE', 'w780')
+POSTER_CACHE_DIR = os.environ.get('POSTER_CACHE_DIR', 'poster_cache')  # fetched originals named by sha256 (outside SITE_DIR)
+POSTER_MEMO_SIZE = int(os.environ.get('POSTER_MEMO_SIZE', '4096'))  # localized posters remembered per process
+POSTER_RETRY_MINUTES = float(os.environ.get('POSTER_RETRY_MINUTES', '30'))  # after a failed poster fetch
+POSTER_CACHE_LIVE_DIR: Optional[str] = None  # dry runs only: the live cache, read but never written
+IMAGES_SUBDIR = os.environ.get('IMAGES_SUBDIR', 'img')  # relative to SITE_DIR
+POSTER_WIDTHS = [int(x) for x in os.environ.get('POSTER_WIDTHS', '185,342,500,780').split(',') if x.strip()]
+POSTER_FORMATS = [x.strip().lower() for x in os.environ.get('POSTER_FORMATS', 'avif,webp').split(',') if x.strip()]
+POSTER_SIZES_ATTR = os.environ.get('POSTER_SIZES_ATTR', '(max-width: 768px) 100vw, 342px')
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', '2'))
+
+# `python main.py check`: process-pool size and pages per worker task
+CHECK_WORKERS = int(os.environ.get('CHECK_WORKERS', str(os.cpu_count() or 2)))
+CHECK_BATCH = int(os.environ.get('CHECK_BATCH', '500'))
+RERENDER_MAX_ATTEMPTS = int(os.environ.get('RERENDER_MAX_ATTEMPTS', '5'))  # a queued re-render is dropped after this many failures
+RERENDER_RETRY_MINUTES = float(os.environ.get('RERENDER_RETRY_MINUTES', '10'))  # wait after a failed re-render; doubles per attempt
+
 # processing
 CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', '200'))
+# render episode pages of a series from one pre-rendered skeleton (verified against the full renderer)
+SKELETON_RENDER = os.environ.get('SKELETON_RENDER', '1') == '1'
+
+# Page layout under every site dir: 'date' writes YYYY/MM/<slug>.html; 'hash' writes YYYY/MM/<h2>/<slug>.html,
+# <h2> being the low byte of the slug's FNV-1a hash (up to 256 directories a month instead of one huge one).
+# `python main.py reshard` moves an existing tree to the configured layout and keeps the old URLs working.
+SITE_LAYOUT = os.environ.get('SITE_LAYOUT', 'date')
+if SITE_LAYOUT not in ('date', 'hash'):
+    raise ValueError(f"SITE_LAYOUT must be 'date' or 'hash' (got {SITE_LAYOUT!r})")
+
+# Bookkeeping unit of work: published rows + imdb_queue status + queue-file removals are committed
+# together once this many pages are pending or the oldest pending page is this many seconds old
+BOOKKEEPING_BATCH_SIZE = int(os.environ.get('BOOKKEEPING_BATCH_SIZE', '20'))
+BOOKKEEPING_BATCH_SECONDS = float(os.environ.get('BOOKKEEPING_BATCH_SECONDS', '60'))
+
+# Dry run (DRY_RUN=1): one full cycle against the live queue, but every path the publisher writes
+# (SITE_DIR, both databases, the queue file, cursor and progress files) is redirected into a shadow
+# directory seeded with copies of the live state; git and sleeps are skipped and a per-stage
+# timing/bytes report is logged. The shadow goes to DRY_RUN_DIR, else a fresh dir on /dev/shm (tmpfs).
+DRY_RUN = os.environ.get('DRY_RUN', '0') == '1'
+DRY_RUN_DIR = os.environ.get('DRY_RUN_DIR', '')
+
+def _shadow_state(shadow_dir: str):
+    """Copy the live state into shadow_dir and point the path settings at the copies (before any use)."""
+    global SITE_DIR, DB_PATH, IMDB_DB_PATH, IMDB_FILE, IMDB_QUEUE_CURSOR_FILE, TV_CHANGES_PROGRESS_FILE, DISCOVER_PROGRESS_FILE
+    global POSTER_CACHE_DIR, POSTER_CACHE_LIVE_DIR
+    os.makedirs(shadow_dir, exist_ok=True)
+
+    def shadow(path: str) -> str:
+        target = os.path.join(shadow_dir, os.path.basename(path))
+        if os.path.exists(path):
+            shutil.copy2(path, target)
+        return target
+
+    def shadow_db(path: str) -> str:
+        target = os.path.join(shadow_dir, os.path.basename(path))
+        if os.path.exists(path):
+            src, dst = sqlite3.connect(path), sqlite3.connect(target)
+            try:
+                src.backup(dst)  # consistent copy even while a live publisher is writing
+            finally:
+                src.close()
+                dst.close()
+        return target
+
+    SITE_DIR = os.path.join(shadow_dir, 'site')
+    os.makedirs(SITE_DIR, exist_ok=True)
+    DB_PATH = shadow_db(DB_PATH)
+    IMDB_DB_PATH = shadow_db(IMDB_DB_PATH)
+    IMDB_FILE = shadow(IMDB_FILE)
+    IMDB_QUEUE_CURSOR_FILE = shadow(IMDB_QUEUE_CURSOR_FILE)
+    TV_CHANGES_PROGRESS_FILE = shadow(TV_CHANGES_PROGRESS_FILE)
+    DISCOVER_PROGRESS_FILE = shadow(DISCOVER_PROGRESS_FILE)
+    # the poster cache can be large: new downloads go to the shadow, cached originals are still read from the live dir
+    POSTER_CACHE_LIVE_DIR = POSTER_CACHE_DIR
+    POSTER_CACHE_DIR = os.path.join(shadow_dir, 'poster_cache')
+
+# check worker processes (forkserver) import this module too; they get their paths as arguments and must not shadow again
+_WORKER_PROCESS = multiprocessing.parent_process() is not None
+
+if DRY_RUN and not _WORKER_PROCESS:
+    DRY_RUN_DIR = DRY_RUN_DIR or tempfile.mkdtemp(prefix='publisher_dryrun_', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    _shadow_state(DRY_RUN_DIR)
+
+# Site targets: mirror/regional sites fed from one TMDB fetch per title. SITE_TARGETS is a JSON list
+# (inline, or the path of a .json file) of {"name", "site_dir", "base_url", "template", "git_remote"};
+# "template" is a jinja file used instead of HTML_TEMPLATE. Unset, SITE_DIR/GITHUB_PAGES_URL form the
+# only target. The first target is the primary: SITE_DIR/GITHUB_PAGES_URL follow it, url_index stores
+# its URLs, and its published rows keep target NULL (so older rows stay attributed to it).
+SITE_TARGETS = os.environ.get('SITE_TARGETS', '')
+TARGET_WORKERS = int(os.environ.get('TARGET_WORKERS', '4'))
+
+class SiteTarget:
+    """One output site: its own directory, public URL, page template and git remote."""
+
+    def __init__(self, name: str, site_dir: str, base_url: str = '', template_path: Optional[str] = None, git_remote: Optional[str] = None):
+        self.name = name
+        self.site_dir = site_dir
+        self.base_url = base_url or ''
+        self.template_path = template_path
+        self.git_remote = git_remote
+        self._template: Optional[Template] = None
+
+    def template(self) -> Template:
+        if self._template is None:
+            source = HTML_TEMPLATE
+            if self.template_path:
+                with open(self.template_path, encoding='utf-8') as f:
+                    source = f.read()
+            self._template = Template(source)
+        return self._template
+
+    def __repr__(self):
+        return f'SiteTarget({self.name!r}, {self.site_dir!r})'
+
+def _load_site_targets(spec: str) -> List[SiteTarget]:
+    if not spec.strip():
+        return [SiteTarget('default', SITE_DIR, GITHUB_PAGES_URL)]
+    if not spec.lstrip().startswith('['):
+        with open(spec, encoding='utf-8') as f:
+            spec = f.read()
+    targets = []
+    for i, t in enumerate(json.loads(spec)):
+        if not t.get('site_dir'):
+            raise ValueError(f'SITE_TARGETS entry {i} has no site_dir')
+        targets.append(SiteTarget(t.get('name') or f'site{i}', t['site_dir'], t.get('base_url') or '', t.get('template') or None, t.get('git_remote') or None))
+    names = [t.name for t in targets]
+    if not targets or len(set(names)) != len(names):
+        raise ValueError(f'SITE_TARGETS needs at least one target and unique names (got {names})')
+    return targets
+
+TARGETS = _load_site_targets(SITE_TARGETS)
+if DRY_RUN and not _WORKER_PROCESS:
+    # the primary writes into the shadow SITE_DIR, mirrors next to it
+    for _i, _t in enumerate(TARGETS):
+        _t.site_dir = SITE_DIR if _i == 0 else os.path.join(DRY_RUN_DIR, f'site-{_t.name}')
+SITE_DIR, GITHUB_PAGES_URL = TARGETS[0].site_dir, TARGETS[0].base_url
 
 # Template (kept as provided)
 HTML_TEMPLATE = r"""
 <div class="egy-single-post">
     <div class="egy-post-top">
         <div class="egy-post-right">
-            <img src="{{ image_url }}" width="100%" height="100%" >
+            <picture>
+                {% if poster_avif %}<source type="image/avif" srcset="{{ poster_avif }}" sizes="{{ poster_sizes }}">{% endif %}
+                {% if poster_webp %}<source type="image/webp" srcset="{{ poster_webp }}" sizes="{{ poster_sizes }}">{% endif %}
+                <img src="{{ image_url }}" width="100%" height="100%" >
+            </picture>
             <a href="https://www.effectivegatecpm.com/zrvavtngbz?key=30616f742797c861a0b30871c8d155c4" class="egy-post-watch"><i class="fa fa-cloud-download"></i> تحميل مباشر</a>
         </div>
         <div class="egy-post-left">
@@ -156,6 +386,67 @@ HTML_TEMPLATE = r"""
 </div>
 """
 
+# Invariant page chrome shared by every page (the tab-switching script the template's onclick relies on,
+# and the search client). Written once per content hash under SITE_DIR/ASSETS_SUBDIR so browsers and
+# the CDN can cache it forever.
+SHARED_JS = r"""
+function openCity(evt, id) {
+    var i, tabs = document.getElementsByClassName('tabcontent'), links = document.getElementsByClassName('tablinks');
+    for (i = 0; i < tabs.length; i++) { tabs[i].style.display = 'none'; }
+    for (i = 0; i < links.length; i++) { links[i].className = links[i].className.replace(' active', ''); }
+    document.getElementById(id).style.display = 'block';
+    evt.currentTarget.className += ' active';
+}
+
+// search index location relative to this script, filled in from ASSETS_SUBDIR / SEARCH_INDEX_SUBDIR
+var SEARCH_BASE = new URL(__SEARCH_REL__ + '/', document.currentScript ? document.currentScript.src : location.href).href;
+var searchShards = {}, searchManifest = null;
+function searchNormalize(q) {
+    // strip Latin accents (NFD + combining marks) the way unidecode does server-side: "Amélie" -> "amelie"
+    q = q.toLowerCase().normalize('NFD').replace(/[\u0300-\u036f]/g, '').replace(/[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]/g, '')
+        .replace(/[أإآٱ]/g, 'ا').replace(/ة/g, 'ه').replace(/[ىئی]/g, 'ي').replace(/ؤ/g, 'و').replace(/ک/g, 'ك');
+    return q.split(/[^a-z0-9\u0621-\u064a]+/).filter(Boolean);
+}
+function searchShardName(token, len) {
+    var p = token.slice(0, len);
+    if (/^[a-z0-9]+$/.test(p)) { return p; }
+    return 'u' + Array.prototype.map.call(new TextEncoder().encode(p), function (b) { return ('0' + b.toString(16)).slice(-2); }).join('');
+}
+function fetchJson(url) { return fetch(url).then(function (r) { return r.ok ? r.json() : null; }); }
+// years are not indexed as tokens: a year-like word narrows the hits by doc year (or a name word) instead
+function searchIsYear(t) { return /^(1[89]|20)[0-9]{2}$/.test(t); }
+function searchYearMatch(d, y) {
+    return String(d[1] || '').indexOf(y) === 0 || searchNormalize(d[0] || '').some(function (w) { return w.indexOf(y) === 0; });
+}
+function searchTitles(query) {
+    var all = searchNormalize(query);
+    var tokens = all.filter(function (t) { return !searchIsYear(t); });
+    var years = tokens.length ? all.filter(searchIsYear) : [];
+    if (!tokens.length) { tokens = all; }
+    if (!tokens.length) { return Promise.resolve([]); }
+    var manifest = searchManifest || (searchManifest = fetchJson(SEARCH_BASE + 'index.json'));
+    return manifest.then(function (m) {
+        if (!m) { return []; }
+        return Promise.all(tokens.map(function (t) {
+            var name = searchShardName(t, m.prefix_len);
+            if (m.shards.indexOf(name) < 0) { return null; }
+            var shard = searchShards[name] || (searchShards[name] = fetchJson(SEARCH_BASE + name + '.json'));
+            return shard.then(function (s) {
+                if (!s) { return null; }
+                var ids = {};
+                Object.keys(s.tokens).forEach(function (k) { if (k.indexOf(t) === 0) { s.tokens[k].forEach(function (id) { ids[id] = s.docs[id]; }); } });
+                return ids;
+            });
+        })).then(function (sets) {
+            var hits = sets[0] || {};
+            sets.slice(1).forEach(function (s) { Object.keys(hits).forEach(function (id) { if (!s || !(id in s)) { delete hits[id]; } }); });
+            years.forEach(function (y) { Object.keys(hits).forEach(function (id) { if (!searchYearMatch(hits[id], y)) { delete hits[id]; } }); });
+            return Object.keys(hits).map(function (id) { var d = hits[id]; return {imdb_id: id, name: d[0], year: d[1], type: d[2], labels: d[3], url: d[4]}; });
+        });
+    });
+}
+"""
+
 # ---------------------------
 # DB
 # ---------------------------
@@ -170,7 +461,89 @@ CREATE TABLE IF NOT EXISTS published (
     episode INTEGER,
     blog_post_id TEXT,
     url TEXT,
-    date_added TEXT
+    date_added TEXT,
+    labels TEXT, -- comma separated, feeds the client-side search index
+    target TEXT -- SiteTarget name; NULL for the primary target
+);
+-- last known seasons of every published series (drives the TMDB change-feed refresh)
+CREATE TABLE IF NOT EXISTS series_state (
+    imdb_id TEXT PRIMARY KEY,
+    tmdb_id INTEGER NOT NULL,
+    seasons TEXT, -- JSON {season_number: episode_count}
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_series_state_tmdb ON series_state(tmdb_id);
+-- cached /tv/{id}/season/{n} episode metadata (JSON list of {episode_number, air_date, name})
+CREATE TABLE IF NOT EXISTS season_cache (
+    tmdb_id INTEGER NOT NULL,
+    season INTEGER NOT NULL,
+    episodes TEXT,
+    fetched_at TEXT,
+    PRIMARY KEY (tmdb_id, season)
+);
+-- TMDB poster_path -> sha256 of the fetched original (POSTER_CACHE_DIR/<sha256><ext>), so each poster is downloaded once
+CREATE TABLE IF NOT EXISTS poster_cache (
+    poster_path TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    fetched_at TEXT
+);
+-- episodes known but not aired yet; released by the scheduler once air_date <= today
+CREATE TABLE IF NOT EXISTS episode_schedule (
+    imdb_id TEXT NOT NULL,
+    tmdb_id INTEGER NOT NULL,
+    season INTEGER NOT NULL,
+    episode INTEGER NOT NULL,
+    air_date TEXT, -- NULL while TMDB has no date yet
+    attempts INTEGER NOT NULL DEFAULT 0, -- releases that did not get the episode published
+    retry_after TEXT,
+    PRIMARY KEY (imdb_id, season, episode)
+);
+CREATE INDEX IF NOT EXISTS idx_episode_schedule_due ON episode_schedule(air_date);
+-- ids to drop from IMDB_FILE; written in the same transaction as the published rows, replayed after crashes
+CREATE TABLE IF NOT EXISTS queue_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    imdb_id TEXT NOT NULL,
+    created_at TEXT
+);
+-- slug -> page location for every published or reserved page; internal links are lookups here
+CREATE TABLE IF NOT EXISTS url_index (
+    slug TEXT PRIMARY KEY, -- unique site-wide; colliding slugs get -2, -3, ... suffixes
+    rel_path TEXT NOT NULL UNIQUE, -- relative to SITE_DIR, e.g. 2025/10/show-name-1-2.html
+    url TEXT NOT NULL,
+    imdb_id TEXT NOT NULL,
+    season INTEGER,
+    episode INTEGER,
+    reserved_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_url_index_item ON url_index(imdb_id, IFNULL(season, -1), IFNULL(episode, -1));
+-- old -> new page location of every page moved by `main.py reshard`; regenerates each target's redirects.map
+CREATE TABLE IF NOT EXISTS url_redirects (
+    old_path TEXT PRIMARY KEY, -- relative to the site dir, like url_index.rel_path
+    new_path TEXT NOT NULL,
+    moved_at TEXT
+);
+-- pages `main.py check --repair` found missing, stale or with broken links; main() re-renders them
+CREATE TABLE IF NOT EXISTS rerender_queue (
+    imdb_id TEXT NOT NULL,
+    season INTEGER,
+    episode INTEGER,
+    reason TEXT,
+    queued_at TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    retry_after TEXT -- failed re-renders wait until then
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_rerender_queue_item ON rerender_queue(imdb_id, IFNULL(season, -1), IFNULL(episode, -1));
+-- per-series publish journal: lets an interrupted series resume without refetching TMDB
+CREATE TABLE IF NOT EXISTS publish_journal (
+    imdb_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    tmdb_id INTEGER NOT NULL,
+    snapshot TEXT, -- JSON TitleRecord.to_dict()
+    root_date_prefix TEXT, -- unused since url_index (kept for older databases)
+    stage TEXT, -- fetched | root_written | root_linked
+    last_season INTEGER,
+    last_episode INTEGER,
+    updated_at TEXT
 );
 '''
 
@@ -182,36 +555,55 @@ logging.basicConfig(level=logging.INFO)
 # ---------- NEW: counter for actual successful posts in current cycle ----------
 PUBLISHED_THIS_CYCLE = 0
 
+# per-stage [calls, seconds, bytes] for the dry-run report
+_STAGE_STATS: Dict[str, List[float]] = {}
+
+@contextmanager
+def _stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _STAGE_STATS.setdefault(name, [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+def _staged(name: str):
+    def wrap(fn):
+        def inner(*args, **kwargs):
+            with _stage(name):
+                return fn(*args, **kwargs)
+        inner.__name__, inner.__doc__ = fn.__name__, fn.__doc__
+        return inner
+    return wrap
+
+def _stage_bytes(name: str, n: int):
+    _STAGE_STATS.setdefault(name, [0, 0.0, 0])[2] += n
+
+def stage_report(pages: int, wall_seconds: float) -> str:
+    lines = [f"{'stage':<12} {'calls':>7} {'seconds':>9} {'ms/call':>8} {'bytes':>12}"]
+    for name, (calls, seconds, nbytes) in sorted(_STAGE_STATS.items(), key=lambda kv: -kv[1][1]):
+        lines.append(f"{name:<12} {int(calls):>7} {seconds:>9.2f} {1000 * seconds / max(calls, 1):>8.1f} {int(nbytes):>12}")
+    rate = pages / wall_seconds if wall_seconds > 0 else 0.0
+    lines.append(f"{pages} pages in {wall_seconds:.1f}s ({rate:.2f} pages/s without publish sleeps)")
+    return '\n'.join(lines)
+
 # ---------------------------
 # File-based queue helpers
 # ---------------------------
 IMDB_REGEX = re.compile(r'^(tt\d{6,})$', re.IGNORECASE)
+# same rule as IMDB_REGEX, applied line-wise by the regex engine directly over the mmap
+IMDB_LINE_REGEX_BYTES = re.compile(rb'^[ \t\r\f\v]*(tt(\d{6,}))[ \t\r\f\v]*$', re.IGNORECASE | re.MULTILINE)
 
 def ensure_file_exists(path: str):
     if not os.path.exists(path):
         open(path, 'a', encoding='utf-8').close()
 
-def load_imdb_ids_from_txt(path: str = IMDB_FILE) -> List[str]:
-    ensure_file_exists(path)
-    ids = []
-    seen = set()
-    with open(path, 'r', encoding='utf-8') as f:
-        for line in f:
-            s = line.strip()
-            if not s:
-                continue
-            m = IMDB_REGEX.match(s)
-            if not m:
-                continue
-            iid = m.group(1)
-            if iid not in seen:
-                seen.add(iid)
-                ids.append(iid)
-    return ids
-
 def append_imdb_ids_to_txt(new_ids: Iterable[str], path: str = IMDB_FILE) -> int:
+    # the file is not read back: callers pass ids that are new to imdb_queue / published, and a rare
+    # duplicate line is harmless (the queue reader dedupes, published ids are skipped)
     ensure_file_exists(path)
-    existing = set(load_imdb_ids_from_txt(path))
+    existing = set()
     to_add = []
     for i in new_ids:
         if not i:
@@ -225,39 +617,72 @@ def append_imdb_ids_to_txt(new_ids: Iterable[str], path: str = IMDB_FILE) -> int
             to_add.append(iid)
     if not to_add:
         return 0
+    needs_newline = False
+    with open(path, 'rb') as f:
+        # don't glue the first new id onto a last line that has no trailing newline
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b'\n'
     with open(path, 'a', encoding='utf-8') as f:
+        if needs_newline:
+            f.write('\n')
         for iid in to_add:
             f.write(iid + '\n')
     return len(to_add)
 
-def remove_imdb_ids_from_txt(remove_ids: Iterable[str], path: str = IMDB_FILE) -> int:
+def _load_queue_cursor(cursor_path: str) -> Dict[str, int]:
+    try:
+        with open(cursor_path, 'r', encoding='utf-8') as f:
+            data = json.load(f) or {}
+        return {'offset': int(data.get('offset') or 0), 'inode': int(data.get('inode') or 0)}
+    except (OSError, ValueError, TypeError):
+        return {'offset': 0, 'inode': 0}
+
+def _save_queue_cursor(cursor_path: str, offset: int, inode: int):
+    _save_progress(cursor_path, {'offset': offset, 'inode': inode})
+
+def remove_imdb_ids_from_txt(remove_ids: Iterable[str], path: str = IMDB_FILE, cursor_path: str = IMDB_QUEUE_CURSOR_FILE) -> int:
     remove_set = {i for i in (remove_ids or []) if i}
     if not remove_set:
         return 0
     ensure_file_exists(path)
     removed = 0
+    # the rewrite shifts byte offsets: carry the queue cursor over to the same logical position
+    cursor = _load_queue_cursor(cursor_path)
+    track_cursor = cursor['offset'] > 0 and cursor['inode'] == os.stat(path).st_ino
+    new_offset = None
     target_dir = os.path.dirname(os.path.abspath(path)) or '.'
     fd, tmp_path = tempfile.mkstemp(prefix='imdb_tmp_', dir=target_dir, text=True)
     os.close(fd)
     try:
-        with open(path, 'r', encoding='utf-8') as inf, open(tmp_path, 'w', encoding='utf-8') as outf:
+        in_pos = out_pos = 0
+        with open(path, 'r', encoding='utf-8', newline='') as inf, open(tmp_path, 'w', encoding='utf-8', newline='') as outf:
             for line in inf:
+                if track_cursor and new_offset is None and in_pos >= cursor['offset']:
+                    new_offset = out_pos
+                in_pos += len(line.encode('utf-8'))
                 s = line.strip()
                 if not s:
                     continue
                 m = IMDB_REGEX.match(s)
                 if not m:
                     outf.write(line)
+                    out_pos += len(line.encode('utf-8'))
                     continue
                 iid = m.group(1)
                 if iid in remove_set:
                     removed += 1
                 else:
                     outf.write(iid + '\n')
+                    out_pos += len(iid) + 1
+        if track_cursor and new_offset is None:
+            new_offset = out_pos
         try:
             os.replace(tmp_path, path)
         except OSError:
             shutil.move(tmp_path, path)
+        if track_cursor:
+            _save_queue_cursor(cursor_path, new_offset, os.stat(path).st_ino)
     finally:
         if os.path.exists(tmp_path):
             try:
@@ -266,10 +691,84 @@ def remove_imdb_ids_from_txt(remove_ids: Iterable[str], path: str = IMDB_FILE) -
                 pass
     return removed
 
-def iter_imdb_queue(path: str = IMDB_FILE, chunk_size: int = CHUNK_SIZE):
-    ids = load_imdb_ids_from_txt(path)
-    for i in range(0, len(ids), chunk_size):
-        yield ids[i:i+chunk_size]
+def _advance_queue_cursor(path: str, cursor_path: str, done: set):
+    """Move the persisted cursor past the ids in done that directly follow it (after the file was rewritten)."""
+    cursor = _load_queue_cursor(cursor_path)
+    st = os.stat(path)
+    if cursor['inode'] != st.st_ino or cursor['offset'] >= st.st_size:
+        return
+    pos = cursor['offset']
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for m in IMDB_LINE_REGEX_BYTES.finditer(mm, pos):
+            if m.group(1).decode('ascii') not in done:
+                break
+            pos = min(m.end() + 1, len(mm))
+    _save_queue_cursor(cursor_path, pos, st.st_ino)
+
+def _queue_consumer(path: str, cursor_path: str, inode: int, chunk: List[str], ends: List[int]):
+    """consumed(n) of one yielded chunk: persist the cursor just past its first n ids (ends[i] is where id i's line ends)."""
+    def consumed(n: int):
+        if n <= 0:
+            return
+        if os.stat(path).st_ino == inode:
+            _save_queue_cursor(cursor_path, min(ends[n - 1], os.stat(path).st_size), inode)
+        else:
+            # rewritten meanwhile: the cursor was carried over to the chunk start, step over what was handled
+            _advance_queue_cursor(path, cursor_path, set(chunk[:n]))
+    return consumed
+
+def iter_imdb_queue(path: str = IMDB_FILE, chunk_size: int = CHUNK_SIZE, cursor_path: str = IMDB_QUEUE_CURSOR_FILE):
+    """
+    Stream validated, deduped ids in chunks straight from an mmap of the queue file.
+    Yields (chunk, consumed) pairs.
+    - Starts at the persisted byte-offset cursor and advances it past a chunk when the next one is asked for,
+      so a restart resumes mid-file; a completed pass resets it to the top. A consumer that stops inside
+      a chunk calls consumed(n) for the first n ids it handled and leaves the loop without resuming the
+      generator: the cursor then sits right after them and the rest of the chunk comes first next time.
+    - Dedupe uses a fixed-size bitmap over a hash of the numeric id: memory stays flat however large the
+      file is. The hash is salted per generator, so ids that collide (rarely) in one pass do not in the
+      next: a collision skips an id for the rest of this pass only, it is never dropped from the file.
+    - If the file is rewritten underneath us (remove_imdb_ids_from_txt), reading continues from the
+      cursor it translated into the new file.
+    """
+    ensure_file_exists(path)
+    nbits = max(8, QUEUE_DEDUPE_BITS)
+    seen = bytearray((nbits + 7) // 8)
+    salt = random.getrandbits(64)
+    while True:
+        st = os.stat(path)
+        cursor = _load_queue_cursor(cursor_path)
+        pos = cursor['offset'] if cursor['inode'] == st.st_ino and cursor['offset'] <= st.st_size else 0
+        if st.st_size == 0:
+            _save_queue_cursor(cursor_path, 0, st.st_ino)
+            return
+        reopened = False
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            chunk: List[str] = []
+            ends: List[int] = []
+            # a cursor always sits at a line start, so ^ anchors correctly from there
+            for m in IMDB_LINE_REGEX_BYTES.finditer(mm, pos):
+                pos = m.end() + 1
+                bit = hash((salt, int(m.group(2)))) % nbits
+                if seen[bit >> 3] & (1 << (bit & 7)):
+                    continue
+                seen[bit >> 3] |= 1 << (bit & 7)
+                chunk.append(m.group(1).decode('ascii'))
+                ends.append(pos)
+                if len(chunk) >= chunk_size:
+                    yield chunk, _queue_consumer(path, cursor_path, st.st_ino, chunk, ends)
+                    if os.stat(path).st_ino != st.st_ino:
+                        reopened = True
+                        break
+                    _save_queue_cursor(cursor_path, min(pos, size), st.st_ino)
+                    chunk, ends = [], []
+            if not reopened and chunk:
+                yield chunk, _queue_consumer(path, cursor_path, st.st_ino, chunk, ends)
+        if reopened:
+            continue
+        _save_queue_cursor(cursor_path, 0, os.stat(path).st_ino)
+        return
 
 # ---------------------------
 # DB helpers
@@ -278,103 +777,404 @@ def init_db(path: str = DB_PATH):
     conn = sqlite3.connect(path)
     cur = conn.cursor()
     cur.executescript(CREATE_TABLE_SQL)
+    cur.execute("PRAGMA table_info(published)")
+    cols = [r[1] for r in cur.fetchall()]
+    if 'labels' not in cols:
+        cur.execute("ALTER TABLE published ADD COLUMN labels TEXT")
+    if 'target' not in cols:
+        cur.execute("ALTER TABLE published ADD COLUMN target TEXT")
+    cur.execute("PRAGMA table_info(episode_schedule)")
+    cols = [r[1] for r in cur.fetchall()]
+    if 'attempts' not in cols:
+        cur.execute("ALTER TABLE episode_schedule ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    if 'retry_after' not in cols:
+        cur.execute("ALTER TABLE episode_schedule ADD COLUMN retry_after TEXT")
+    cur.execute("PRAGMA table_info(rerender_queue)")
+    cols = [r[1] for r in cur.fetchall()]
+    if 'attempts' not in cols:
+        cur.execute("ALTER TABLE rerender_queue ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    if 'retry_after' not in cols:
+        cur.execute("ALTER TABLE rerender_queue ADD COLUMN retry_after TEXT")
     conn.commit()
     conn.close()
 
-def db_has(imdb_id: str, season: Optional[int] = None, episode: Optional[int] = None) -> bool:
+def _target_key(target: SiteTarget) -> str:
+    # value of published.target / record['target'] for a target; '' stands for NULL (the primary)
+    return '' if target is TARGETS[0] else target.name
+
+def target_for_key(key: Optional[str]) -> Optional[SiteTarget]:
+    return next((t for t in TARGETS if _target_key(t) == (key or '')), None)
+
+# pages being re-rendered (drain_rerender_queue): (imdb_id, season, episode) -> highest published row id before
+# the re-render; older rows do not count as published, so the normal publish path writes the page again
+_RERENDER_AFTER: Dict[Tuple[str, Optional[int], Optional[int]], int] = {}
+
+def published_targets(imdb_id: str, season: Optional[int] = None, episode: Optional[int] = None) -> set:
+    """Keys (see _target_key) of the targets that already have the page, including unflushed records."""
+    found = _pending_targets(imdb_id, season, episode)
+    after = _RERENDER_AFTER.get((imdb_id, season, episode), 0)
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
     try:
         if season is None and episode is None:
-            cur.execute('SELECT 1 FROM published WHERE imdb_id=? AND season IS NULL AND episode IS NULL', (imdb_id,))
+            cur.execute("SELECT DISTINCT IFNULL(target, '') FROM published WHERE imdb_id=? AND season IS NULL AND episode IS NULL AND id > ?", (imdb_id, after))
         elif season is not None and episode is not None:
-            cur.execute('SELECT 1 FROM published WHERE imdb_id=? AND season=? AND episode=?', (imdb_id, season, episode))
+            cur.execute("SELECT DISTINCT IFNULL(target, '') FROM published WHERE imdb_id=? AND season=? AND episode=? AND id > ?", (imdb_id, season, episode, after))
         elif season is not None and episode is None:
-            cur.execute('SELECT 1 FROM published WHERE imdb_id=? AND season=?', (imdb_id, season))
+            cur.execute("SELECT DISTINCT IFNULL(target, '') FROM published WHERE imdb_id=? AND season=? AND id > ?", (imdb_id, season, after))
         else:
-            cur.execute('SELECT 1 FROM published WHERE imdb_id=?', (imdb_id,))
-        r = cur.fetchone()
-        return r is not None
+            cur.execute("SELECT DISTINCT IFNULL(target, '') FROM published WHERE imdb_id=? AND id > ?", (imdb_id, after))
+        found.update(r[0] for r in cur.fetchall())
+        return found
     finally:
         conn.close()
 
-def db_insert(record: Dict[str, Any]):
+def db_has(imdb_id: str, season: Optional[int] = None, episode: Optional[int] = None) -> bool:
+    """True once every configured target has the page."""
+    return {_target_key(t) for t in TARGETS} <= published_targets(imdb_id, season, episode)
+
+_PAGE_PATH_RE = re.compile(r'(\d{4}/\d{2}/(?:[0-9a-f]{2}/)?[^/]+\.html)$')
+_PAGE_PARTS_RE = re.compile(r'(\d{4}/\d{2})/(?:[0-9a-f]{2}/)?([^/]+)\.html')
+
+def slug_shard(slug: str) -> str:
+    # low byte of 32-bit FNV-1a over the UTF-8 slug; the 404.html redirect script computes the same
+    h = 0x811c9dc5
+    for b in slug.encode('utf-8'):
+        h = ((h ^ b) * 0x01000193) & 0xffffffff
+    return f"{h & 0xff:02x}"
+
+def page_rel_path(month_dir: str, slug: str, layout: Optional[str] = None) -> str:
+    """Location of a page relative to the site dir under SITE_LAYOUT (or the given layout)."""
+    if (layout or SITE_LAYOUT) == 'hash':
+        return f"{month_dir}/{slug_shard(slug)}/{slug}.html"
+    return f"{month_dir}/{slug}.html"
+
+def relayout_rel_path(rel_path: str, layout: Optional[str] = None) -> str:
+    m = _PAGE_PARTS_RE.fullmatch(rel_path)
+    return page_rel_path(m.group(1), m.group(2), layout) if m else rel_path
+
+def _page_url(rel_path: str, target: Optional[SiteTarget] = None) -> str:
+    target = target or current_target()
+    if target.base_url:
+        return f"{target.base_url.rstrip('/')}/{rel_path}"
+    return str((Path(target.site_dir) / rel_path).resolve())
+
+def page_link(rel_path: str) -> str:
+    """Root-relative href of a page, as used in internal links."""
+    return f"{_site_base_path()}/{rel_path}"
+
+def _url_index_row(row) -> Dict[str, Any]:
+    return {'slug': row[0], 'rel_path': row[1], 'url': row[2], 'season': row[3], 'episode': row[4]}
+
+def url_lookup(imdb_id: str, season: Optional[int] = None, episode: Optional[int] = None) -> Optional[Dict[str, Any]]:
     conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO published (imdb_id, content_type, name, year, season, episode, blog_post_id, url, date_added)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        record.get('imdb_id'), record.get('content_type'), record.get('name'), record.get('year'),
-        record.get('season'), record.get('episode'), record.get('blog_post_id'), record.get('url'),
-        datetime.now(timezone.utc).isoformat()
-    ))
-    conn.commit()
-    conn.close()
+    try:
+        row = conn.execute('SELECT slug, rel_path, url, season, episode FROM url_index WHERE imdb_id=? AND IFNULL(season, -1)=? AND IFNULL(episode, -1)=?',
+                           (imdb_id, -1 if season is None else season, -1 if episode is None else episode)).fetchone()
+    finally:
+        conn.close()
+    return _url_index_row(row) if row else None
+
+def url_reserve_many(imdb_id: str, items: List[Tuple[Optional[int], Optional[int], str]]) -> Dict[Tuple[Optional[int], Optional[int]], Dict[str, Any]]:
+    """
+    Look up or reserve the page location of each (season, episode, base_slug) of one title.
+    - New pages get SITE_DIR/YYYY/MM/[<h2>/]<slug>.html of the reservation month and keep it, so links
+      built now stay valid when the page itself is published in a later month.
+    - A slug already owned by another page gets the first free -2, -3, ... suffix.
+    """
+    out: Dict[Tuple[Optional[int], Optional[int]], Dict[str, Any]] = {}
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        for row in conn.execute('SELECT slug, rel_path, url, season, episode FROM url_index WHERE imdb_id=?', (imdb_id,)):
+            out[(row[3], row[4])] = _url_index_row(row)
+        missing = [(sn, ep, base) for sn, ep, base in items if (sn, ep) not in out]
+        if not missing:
+            return out
+        now = datetime.now(timezone.utc)
+        month_dir = f"{now.year:04d}/{now.month:02d}"
+        with conn:
+            for sn, ep, base in missing:
+                base = base or slugify(imdb_id) or f"post-{int(now.timestamp())}"
+                n = 1
+                while True:
+                    slug = base if n == 1 else f"{base}-{n}"
+                    rel_path = page_rel_path(month_dir, slug)
+                    try:
+                        conn.execute('INSERT INTO url_index (slug, rel_path, url, imdb_id, season, episode, reserved_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     (slug, rel_path, _page_url(rel_path, TARGETS[0]), imdb_id, sn, ep, now.isoformat()))
+                        break
+                    except sqlite3.IntegrityError:
+                        row = conn.execute('SELECT slug, rel_path, url, season, episode FROM url_index WHERE imdb_id=? AND IFNULL(season, -1)=? AND IFNULL(episode, -1)=?',
+                                           (imdb_id, -1 if sn is None else sn, -1 if ep is None else ep)).fetchone()
+                        if row:
+                            # reserved concurrently by another process
+                            slug, rel_path = row[0], row[1]
+                            break
+                        n += 1
+                if n > 1:
+                    logging.warning('Slug %s is taken by another page; %s S%sE%s uses %s', base, imdb_id, sn, ep, slug)
+                out[(sn, ep)] = {'slug': slug, 'rel_path': rel_path, 'url': _page_url(rel_path, TARGETS[0]), 'season': sn, 'episode': ep}
+    finally:
+        conn.close()
+    return out
+
+def url_reserve(imdb_id: str, season: Optional[int], episode: Optional[int], base_slug: str) -> Dict[str, Any]:
+    # single-row lookup first: url_reserve_many reads every url_index row of the title
+    return url_lookup(imdb_id, season, episode) or url_reserve_many(imdb_id, [(season, episode, base_slug)])[(season, episode)]
+
+def backfill_url_index() -> int:
+    """Index pages published before url_index existed, from the stored url of each published row."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute('''SELECT p.imdb_id, p.season, p.episode, p.url FROM published p
+                               LEFT JOIN url_index u ON u.imdb_id = p.imdb_id AND IFNULL(u.season, -1) = IFNULL(p.season, -1)
+                                                    AND IFNULL(u.episode, -1) = IFNULL(p.episode, -1)
+                               WHERE u.slug IS NULL AND p.target IS NULL''').fetchall()
+        added = 0
+        now = datetime.now(timezone.utc).isoformat()
+        with conn:
+            for imdb_id, sn, ep, url in rows:
+                m = _PAGE_PATH_RE.search(urlparse(url or '').path.replace(os.sep, '/'))
+                if not m:
+                    logging.warning('Cannot index %s S%sE%s: unrecognised url %s', imdb_id, sn, ep, url)
+                    continue
+                rel_path = m.group(1)
+                cur = conn.execute('INSERT OR IGNORE INTO url_index (slug, rel_path, url, imdb_id, season, episode, reserved_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   (Path(rel_path).stem, rel_path, url, imdb_id, sn, ep, now))
+                if cur.rowcount:
+                    added += 1
+                else:
+                    logging.warning('Slug collision while indexing %s S%sE%s (%s); page was overwritten by another title.', imdb_id, sn, ep, rel_path)
+    finally:
+        conn.close()
+    if added:
+        logging.info('Indexed %s previously published pages in url_index', added)
+    return added
+
+def _season_counts(seasons_list: List[Dict[str, Any]]) -> Dict[str, int]:
+    counts = {}
+    for s in seasons_list or []:
+        sn = s.get('season_number')
+        if sn is None or sn == 0:
+            continue
+        counts[str(sn)] = int(s.get('episode_count') or 0)
+    return counts
+
+def save_series_state(imdb_id: str, tmdb_id: int, seasons_list: List[Dict[str, Any]]):
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            conn.execute('INSERT OR REPLACE INTO series_state (imdb_id, tmdb_id, seasons, updated_at) VALUES (?, ?, ?, ?)',
+                         (imdb_id, tmdb_id, json.dumps(_season_counts(seasons_list)), datetime.now(timezone.utc).isoformat()))
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception:
+        logging.exception('Failed to save series state for %s', imdb_id)
 
 # ---------------------------
-# mark imdb_queue status as published (if imdb_queue DB exists)
+# Publish journal (crash-safe resume of series publishing)
 # ---------------------------
-def mark_imdb_published(imdb_id: str, imdb_db_path: str = IMDB_DB_PATH) -> bool:
+def journal_title(entry: Dict[str, Any]) -> 'TitleRecord':
+    snap = entry.get('snapshot') or {}
+    if 'ar' in snap or 'en' in snap:
+        # journals written before TitleRecord kept the raw payloads
+        return TitleRecord.from_tmdb(entry['imdb_id'], entry['kind'], entry['tmdb_id'], snap.get('ar') or {}, snap.get('en') or {})
+    return TitleRecord.from_dict(snap)
+
+def journal_get(imdb_id: str) -> Optional[Dict[str, Any]]:
+    conn = sqlite3.connect(DB_PATH)
     try:
-        if not os.path.exists(imdb_db_path):
-            logging.debug('IMDB DB path %s does not exist; skip mark_imdb_published for %s', imdb_db_path, imdb_id)
-            return False
-        conn = sqlite3.connect(imdb_db_path)
-        cur = conn.cursor()
+        conn.row_factory = sqlite3.Row
+        row = conn.execute('SELECT * FROM publish_journal WHERE imdb_id=?', (imdb_id,)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    entry = dict(row)
+    entry['snapshot'] = json.loads(entry.get('snapshot') or '{}')
+    return entry
+
+def journal_begin(title: 'TitleRecord'):
+    imdb_id, kind, tmdb_id = title.imdb_id, title.kind, title.tmdb_id
+    snapshot = json.dumps(title.to_dict(), ensure_ascii=False)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute('''INSERT OR REPLACE INTO publish_journal (imdb_id, kind, tmdb_id, snapshot, root_date_prefix, stage, last_season, last_episode, updated_at)
+                        VALUES (?, ?, ?, ?, NULL, 'fetched', NULL, NULL, ?)''',
+                     (imdb_id, kind, tmdb_id, snapshot, datetime.now(timezone.utc).isoformat()))
+        conn.commit()
+    finally:
+        conn.close()
+
+def journal_update(imdb_id: str, **fields):
+    """Update journal columns (stage, root_date_prefix, last_season, last_episode); no-op without a journal entry."""
+    if not fields:
+        return
+    fields['updated_at'] = datetime.now(timezone.utc).isoformat()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute(f"UPDATE publish_journal SET {', '.join(k + '=?' for k in fields)} WHERE imdb_id=?", (*fields.values(), imdb_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def journal_clear(imdb_id: str):
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute('DELETE FROM publish_journal WHERE imdb_id=?', (imdb_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def journal_pending() -> List[str]:
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return [r[0] for r in conn.execute('SELECT imdb_id FROM publish_journal ORDER BY updated_at')]
+    finally:
+        conn.close()
+
+# ---------------------------
+# Bookkeeping unit of work (published_items.db + imdb_queue.db + IMDB_FILE)
+# ---------------------------
+_PENDING_RECORDS: List[Dict[str, Any]] = []
+_PENDING_REMOVALS: List[str] = []
+_PENDING_SINCE: Optional[float] = None
+
+def _pending_targets(imdb_id: str, season: Optional[int], episode: Optional[int]) -> set:
+    found = set()
+    for r in _PENDING_RECORDS:
+        if r.get('imdb_id') != imdb_id:
+            continue
+        if season is None and episode is None:
+            if r.get('season') is None and r.get('episode') is None:
+                found.add(r.get('target') or '')
+        elif episode is None:
+            if r.get('season') == season:
+                found.add(r.get('target') or '')
+        elif r.get('season') == season and r.get('episode') == episode:
+            found.add(r.get('target') or '')
+    return found
+
+def _maybe_flush_bookkeeping():
+    global _PENDING_SINCE
+    if _PENDING_SINCE is None:
+        _PENDING_SINCE = time.monotonic()
+    if len(_PENDING_RECORDS) >= BOOKKEEPING_BATCH_SIZE or time.monotonic() - _PENDING_SINCE >= BOOKKEEPING_BATCH_SECONDS:
+        flush_bookkeeping()
+
+def record_published(record: Dict[str, Any], journal: Optional[Dict[str, Any]] = None, flush: bool = False):
+    """
+    Queue the bookkeeping of one published page: its published row, the imdb_queue status,
+    the IMDB_FILE removal and (optionally) a publish_journal update - all committed by flush_bookkeeping().
+    """
+    entry = dict(record)
+    entry['_journal'] = journal
+    _PENDING_RECORDS.append(entry)
+    _PENDING_REMOVALS.append(record.get('imdb_id'))
+    if flush:
+        flush_bookkeeping()
+    else:
+        _maybe_flush_bookkeeping()
+
+def queue_remove(imdb_id: str):
+    """Queue removal of an id from IMDB_FILE (committed with the next bookkeeping flush)."""
+    _PENDING_REMOVALS.append(imdb_id)
+    _maybe_flush_bookkeeping()
+
+def _attach_imdb_queue(conn: sqlite3.Connection) -> bool:
+    if not os.path.exists(IMDB_DB_PATH):
+        return False
+    conn.execute('ATTACH DATABASE ? AS q', (IMDB_DB_PATH,))
+    if not conn.execute("SELECT 1 FROM q.sqlite_master WHERE type='table' AND name='imdb_queue'").fetchone():
+        return False
+    cols = [r[1] for r in conn.execute('PRAGMA q.table_info(imdb_queue)')]
+    for col in ('status', 'published_at'):
+        if col not in cols:
+            conn.execute(f'ALTER TABLE q.imdb_queue ADD COLUMN {col} TEXT')
+    return True
+
+@_staged('bookkeeping')
+def flush_bookkeeping() -> int:
+    """
+    Commit all pending bookkeeping in one transaction spanning both databases (imdb_queue.db is
+    ATTACHed; SQLite's multi-file commit keeps them in step), then apply the queue log to IMDB_FILE.
+    Returns the number of published rows written.
+    """
+    global _PENDING_SINCE
+    records = list(_PENDING_RECORDS)
+    removals = list(dict.fromkeys(i for i in _PENDING_REMOVALS if i))
+    if not records and not removals:
+        _PENDING_SINCE = None
+        return 0
+    now = datetime.now(timezone.utc).isoformat()
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        has_queue = _attach_imdb_queue(conn)
+        conn.execute('BEGIN IMMEDIATE')
         try:
-            cur.execute("PRAGMA table_info(imdb_queue)")
-            cols = [r[1] for r in cur.fetchall()]
-            if 'status' not in cols:
-                try:
-                    cur.execute("ALTER TABLE imdb_queue ADD COLUMN status TEXT")
-                except Exception:
-                    pass
-            if 'published_at' not in cols:
-                try:
-                    cur.execute("ALTER TABLE imdb_queue ADD COLUMN published_at TEXT")
-                except Exception:
-                    pass
+            conn.executemany('''
+                INSERT INTO published (imdb_id, content_type, name, year, season, episode, blog_post_id, url, date_added, labels, target)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(r.get('imdb_id'), r.get('content_type'), r.get('name'), r.get('year'), r.get('season'), r.get('episode'),
+                   r.get('blog_post_id'), r.get('url'), now, ','.join(r.get('labels') or []), r.get('target') or None) for r in records])
+            if has_queue:
+                conn.executemany('UPDATE q.imdb_queue SET status=?, published_at=? WHERE imdb_id=?',
+                                 [('published', now, i) for i in dict.fromkeys(r.get('imdb_id') for r in records)])
+            for r in records:
+                if r.get('_journal'):
+                    fields = dict(r['_journal'], updated_at=now)
+                    conn.execute(f"UPDATE publish_journal SET {', '.join(k + '=?' for k in fields)} WHERE imdb_id=?", (*fields.values(), r.get('imdb_id')))
+            conn.executemany('INSERT INTO queue_log (imdb_id, created_at) VALUES (?, ?)', [(i, now) for i in removals])
+            conn.execute('COMMIT')
         except Exception:
-            pass
-        now = datetime.now(timezone.utc).isoformat()
-        cur.execute("UPDATE imdb_queue SET status=?, published_at=? WHERE imdb_id=?", ('published', now, imdb_id))
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+    del _PENDING_RECORDS[:len(records)]
+    _PENDING_REMOVALS.clear()
+    _PENDING_SINCE = None
+    logging.info('Committed bookkeeping for %s pages (%s queue removals)', len(records), len(removals))
+    for r in records:
+        target = target_for_key(r.get('target'))
+        if target is not None:
+            search_index_add(r, target.site_dir)
+    apply_queue_log()
+    return len(records)
+
+def apply_queue_log() -> int:
+    """Remove every logged id from IMDB_FILE in one rewrite, then drop the applied log entries."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute('SELECT id, imdb_id FROM queue_log ORDER BY id').fetchall()
+        if not rows:
+            return 0
+        removed = remove_imdb_ids_from_txt([r[1] for r in rows], IMDB_FILE)
+        conn.execute('DELETE FROM queue_log WHERE id <= ?', (rows[-1][0],))
         conn.commit()
-        updated = cur.rowcount if hasattr(cur, 'rowcount') else 0
+    finally:
         conn.close()
-        if updated:
-            logging.info('Marked imdb_queue %s as published in %s', imdb_id, imdb_db_path)
-            return True
-        else:
-            return False
-    except Exception:
-        logging.exception('Failed to mark imdb_queue %s as published', imdb_id)
-        return False
+    logging.info('Applied queue log: %s ids logged, %s lines removed from %s', len(rows), removed, IMDB_FILE)
+    return removed
 
-def imdb_queue_is_published(imdb_id: str, imdb_db_path: str = IMDB_DB_PATH) -> bool:
+def reconcile_bookkeeping():
+    """
+    Startup repair for stores left out of step by older runs: replay the queue log and mark imdb_queue rows
+    of published titles as published. Already-published ids still in IMDB_FILE are dropped by the queue
+    loop as it reaches them (db_has), so startup never reads the whole file.
+    """
+    apply_queue_log()
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
     try:
-        if not os.path.exists(imdb_db_path):
-            return False
-        conn = sqlite3.connect(imdb_db_path)
-        cur = conn.cursor()
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='imdb_queue'")
-        if not cur.fetchone():
-            conn.close()
-            return False
-        cur.execute("PRAGMA table_info(imdb_queue)")
-        cols = [r[1] for r in cur.fetchall()]
-        if 'status' in cols:
-            cur.execute("SELECT status FROM imdb_queue WHERE imdb_id=? LIMIT 1", (imdb_id,))
-            row = cur.fetchone()
-            conn.close()
-            if row and (row[0] or '').lower() == 'published':
-                return True
-            return False
-        else:
-            conn.close()
-            return False
-    except Exception:
-        return False
+        if _attach_imdb_queue(conn):
+            now = datetime.now(timezone.utc).isoformat()
+            conn.execute('BEGIN')
+            conn.execute('''UPDATE q.imdb_queue SET status='published', published_at=COALESCE(published_at, ?)
+                            WHERE COALESCE(status, '') != 'published' AND imdb_id IN (SELECT imdb_id FROM main.published)''', (now,))
+            conn.execute('COMMIT')
+    finally:
+        conn.close()
 
 # ---------------------------
 # Utility helpers
@@ -392,50 +1192,273 @@ def slugify(text: str) -> str:
 # ---------------------------
 TMDB_BASE = 'https://api.themoviedb.org/3'
 
+_RATE_DB_READY = False
+
+def _rate_conn() -> sqlite3.Connection:
+    global _RATE_DB_READY
+    # isolation_level=None: transactions are opened explicitly with BEGIN IMMEDIATE
+    conn = sqlite3.connect(TMDB_RATE_DB, timeout=30, isolation_level=None)
+    if not _RATE_DB_READY:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS tmdb_rate (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            rate REAL NOT NULL,          -- current allowance, requests per second
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL,       -- time.time() of the last refill
+            blocked_until REAL NOT NULL  -- set from Retry-After on 429
+        )''')
+        conn.execute('INSERT OR IGNORE INTO tmdb_rate (id, rate, tokens, updated, blocked_until) VALUES (1, ?, ?, ?, 0)',
+                     (max(TMDB_RATE_MIN, TMDB_RATE_MAX / 2), TMDB_RATE_BURST, time.time()))
+        _RATE_DB_READY = True
+    return conn
+
+def tmdb_rate_acquire():
+    """Block until the shared bucket grants one TMDB request."""
+    while True:
+        conn = _rate_conn()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rate, tokens, updated, blocked_until = conn.execute('SELECT rate, tokens, updated, blocked_until FROM tmdb_rate WHERE id=1').fetchone()
+            now = time.time()
+            tokens = min(TMDB_RATE_BURST, tokens + max(0.0, now - updated) * rate)
+            if now < blocked_until:
+                wait = blocked_until - now
+            elif tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute('UPDATE tmdb_rate SET tokens=?, updated=? WHERE id=1', (tokens, now))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        if wait <= 0:
+            return
+        time.sleep(min(wait, 5.0))
+
+def tmdb_rate_feedback(status: Optional[int], latency: float, retry_after: Optional[float] = None):
+    """AIMD update of the shared rate from one response (status None = transport error)."""
+    conn = _rate_conn()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        rate, blocked_until = conn.execute('SELECT rate, blocked_until FROM tmdb_rate WHERE id=1').fetchone()
+        if status == 429:
+            rate *= TMDB_RATE_BACKOFF
+            blocked_until = max(blocked_until, time.time() + (retry_after if retry_after is not None else 1.0))
+        elif status is None or status >= 500 or latency * 1000 > TMDB_LATENCY_TARGET_MS:
+            rate *= (1 + TMDB_RATE_BACKOFF) / 2
+        else:
+            rate += TMDB_RATE_STEP
+        rate = min(TMDB_RATE_MAX, max(TMDB_RATE_MIN, rate))
+        conn.execute('UPDATE tmdb_rate SET rate=?, blocked_until=? WHERE id=1', (rate, blocked_until))
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+def _retry_after_seconds(r) -> Optional[float]:
+    try:
+        return float((r.headers or {}).get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+def tmdb_get(path: str, params: Optional[Dict[str, Any]] = None, timeout: int = 20):
+    """
+    GET {TMDB_BASE}{path} through the shared rate governor; every TMDB API call goes through here.
+    429s are retried (up to TMDB_MAX_RETRIES) after Retry-After; the last response is returned.
+    Transport errors propagate to the caller as before.
+    """
+    params = dict(params or {}, api_key=TMDB_API_KEY)
+    for attempt in range(TMDB_MAX_RETRIES + 1):
+        if TMDB_RATE_GOVERNOR:
+            tmdb_rate_acquire()
+        started = time.monotonic()
+        try:
+            with _stage('tmdb'):
+                r = requests.get(f"{TMDB_BASE}{path}", params=params, timeout=timeout)
+            _stage_bytes('tmdb', len(r.content or b''))
+        except Exception:
+            if TMDB_RATE_GOVERNOR:
+                tmdb_rate_feedback(None, time.monotonic() - started)
+            raise
+        if TMDB_RATE_GOVERNOR:
+            tmdb_rate_feedback(r.status_code, time.monotonic() - started, _retry_after_seconds(r))
+        if r.status_code != 429 or attempt == TMDB_MAX_RETRIES:
+            return r
+        logging.warning('TMDB %s rate limited (429); retry %s/%s', path, attempt + 1, TMDB_MAX_RETRIES)
+        if not TMDB_RATE_GOVERNOR:
+            time.sleep(_retry_after_seconds(r) or 1.0)
+    return r
+
 def tmdb_find_by_imdb(imdb_id: str) -> Optional[Dict[str, Any]]:
-    url = f"{TMDB_BASE}/find/{imdb_id}"
-    params = {'api_key': TMDB_API_KEY, 'external_source': 'imdb_id'}
-    r = requests.get(url, params=params, timeout=20)
+    r = tmdb_get(f"/find/{imdb_id}", {'external_source': 'imdb_id'})
     if r.status_code != 200:
         logging.error('TMDB find failed: %s %s', r.status_code, r.text)
         return None
     return r.json()
 
 def tmdb_get_detail(kind: str, tmdb_id: int, lang: str = 'en') -> Optional[Dict[str, Any]]:
-    url = f"{TMDB_BASE}/{kind}/{tmdb_id}"
-    params = {'api_key': TMDB_API_KEY, 'language': lang, 'append_to_response': 'credits,seasons'}
-    r = requests.get(url, params=params, timeout=20)
+    r = tmdb_get(f"/{kind}/{tmdb_id}", {'language': lang, 'append_to_response': 'credits,seasons'})
     if r.status_code == 200:
         return r.json()
     logging.warning('TMDB detail %s %s lang=%s failed: %s', kind, tmdb_id, lang, r.status_code)
     return None
 
+# ---------------------------
+# Season / episode metadata (air dates)
+# ---------------------------
+def _today_iso() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+def is_aired(air_date: Optional[str], today: Optional[str] = None) -> bool:
+    return bool(air_date) and air_date <= (today or _today_iso())
+
+def _season_cache_fresh(episodes: List[Dict[str, Any]], fetched_at: str, episode_count: Optional[int] = None) -> bool:
+    # the series summary knows of more episodes than the cached list: TMDB added some since
+    if episode_count and len(episodes) < int(episode_count):
+        return False
+    if episodes and all(is_aired(e.get('air_date')) for e in episodes):
+        return True
+    try:
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(fetched_at)
+    except (TypeError, ValueError):
+        return False
+    return age < timedelta(hours=SEASON_CACHE_TTL_HOURS)
+
+def get_season_episodes(tmdb_id: int, season: int, episode_count: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Episode list (episode_number, air_date, name) of one season, from season_cache or TMDB. None if unavailable.
+    episode_count is the season summary's count; a cached list shorter than that is refetched.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        row = conn.execute('SELECT episodes, fetched_at FROM season_cache WHERE tmdb_id=? AND season=?', (tmdb_id, season)).fetchone()
+    finally:
+        conn.close()
+    cached = json.loads(row[0]) if row and row[0] else None
+    if cached is not None and _season_cache_fresh(cached, row[1], episode_count):
+        return cached
+    try:
+        resp = tmdb_get(f"/tv/{tmdb_id}/season/{season}", timeout=15)
+    except Exception:
+        logging.exception('Failed to fetch season detail tmdb=%s season %s', tmdb_id, season)
+        return cached
+    if resp.status_code != 200:
+        logging.warning('TMDB season %s/%s failed: %s', tmdb_id, season, resp.status_code)
+        return cached
+    episodes = [{'episode_number': e.get('episode_number'), 'air_date': e.get('air_date') or None, 'name': e.get('name') or ''}
+                for e in (resp.json().get('episodes') or []) if e.get('episode_number')]
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute('INSERT OR REPLACE INTO season_cache (tmdb_id, season, episodes, fetched_at) VALUES (?, ?, ?, ?)',
+                     (tmdb_id, season, json.dumps(episodes, ensure_ascii=False), datetime.now(timezone.utc).isoformat()))
+        conn.commit()
+    finally:
+        conn.close()
+    return episodes
+
+def season_aired_episodes(tmdb_id: Optional[int], season: Dict[str, Any]):
+    """
+    Split a season into (aired episode numbers, [(episode, air_date), ...] not aired yet).
+    Falls back to 1..episode_count from the season summary when no episode metadata is available.
+    """
+    sn = season.get('season_number')
+    count = season.get('episode_count')
+    return _split_aired(get_season_episodes(tmdb_id, sn, count) if tmdb_id else None, count)
+
+def _split_aired(episodes: Optional[List[Dict[str, Any]]], episode_count: Optional[int]):
+    if episodes is None:
+        return list(range(1, int(episode_count or 0) + 1)), []
+    today = _today_iso()
+    aired, upcoming = [], []
+    for e in episodes:
+        if is_aired(e.get('air_date'), today):
+            aired.append(e['episode_number'])
+        else:
+            upcoming.append((e['episode_number'], e.get('air_date')))
+    return sorted(aired), upcoming
+
+_SEASON_POOL: Optional[ThreadPoolExecutor] = None
+_SEASON_INFLIGHT: Dict[Tuple[int, int, Optional[int]], Future] = {}
+_SEASON_INFLIGHT_LOCK = threading.Lock()
+
+def _season_pool() -> ThreadPoolExecutor:
+    global _SEASON_POOL
+    if _SEASON_POOL is None:
+        _SEASON_POOL = ThreadPoolExecutor(max_workers=max(1, SEASON_WORKERS), thread_name_prefix='season')
+    return _SEASON_POOL
+
+def _season_episodes_future(tmdb_id: int, season: int, episode_count: Optional[int] = None) -> Future:
+    """Single-flight get_season_episodes: callers asking for a season that is already being fetched share that fetch."""
+    key = (tmdb_id, season, episode_count)
+    with _SEASON_INFLIGHT_LOCK:
+        fut = _SEASON_INFLIGHT.get(key)
+        if fut is not None:
+            return fut
+        fut = _SEASON_INFLIGHT[key] = _season_pool().submit(get_season_episodes, tmdb_id, season, episode_count)
+
+    def forget(done: Future):
+        with _SEASON_INFLIGHT_LOCK:
+            if _SEASON_INFLIGHT.get(key) is done:
+                del _SEASON_INFLIGHT[key]
+
+    fut.add_done_callback(forget)
+    return fut
+
+def load_series_metadata(tmdb_id: Optional[int], seasons: List[Dict[str, Any]]) -> Dict[int, Tuple[List[int], List[Tuple[int, Optional[str]]]]]:
+    """
+    {season_number: (aired episode numbers, [(episode, air_date), ...] not aired yet)} for every regular
+    season of a series, in TMDB order; the one structure episode links and episode publishing work from.
+    Season details come from season_cache or are fetched concurrently (SEASON_WORKERS threads), so a
+    series with dozens of uncached seasons costs about one round-trip rather than one per season.
+    """
+    wanted = [s for s in (seasons or []) if s.get('season_number') not in (None, 0)]
+    futures = {s['season_number']: _season_episodes_future(tmdb_id, s['season_number'], s.get('episode_count'))
+               for s in wanted} if tmdb_id else {}
+    series = {}
+    for s in wanted:
+        sn = s['season_number']
+        try:
+            episodes = futures[sn].result() if sn in futures else None
+        except Exception:
+            logging.exception('Failed to load season %s of tmdb=%s', sn, tmdb_id)
+            episodes = None
+        series[sn] = _split_aired(episodes, s.get('episode_count'))
+    return series
+
+def schedule_episodes(imdb_id: str, tmdb_id: int, season: int, upcoming: List[Any]):
+    if not upcoming:
+        return
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.executemany('INSERT OR REPLACE INTO episode_schedule (imdb_id, tmdb_id, season, episode, air_date) VALUES (?, ?, ?, ?, ?)',
+                         [(imdb_id, tmdb_id, season, ep, air_date) for ep, air_date in upcoming])
+        conn.commit()
+    finally:
+        conn.close()
+    logging.info('Scheduled %s upcoming episodes of %s season %s', len(upcoming), imdb_id, season)
+
 # ---------------------------
 # Render helpers (unchanged)
 # ---------------------------
-def build_episodes_html(name_en: str, year: str, seasons: List[Dict[str, Any]], tmdb_id: Optional[int] = None, date_prefix: str = '') -> str:
+def episode_links(name_en: str, series: Dict[int, Tuple[List[int], List[Tuple[int, Optional[str]]]]], imdb_id: Optional[str] = None) -> List[Tuple[int, List[Tuple[int, Optional[str]]]]]:
+    """[(season, [(episode, rel_path)])] of every aired episode in series (see load_series_metadata); shared by all targets."""
     base_slug_episode_name = slugify(name_en or '')
+    # only aired episodes get pages, so only those are linked
+    season_eps = [(sn, aired) for sn, (aired, _) in series.items()]
+    # every linked episode gets its location reserved now, wherever and whenever it is published
+    locations = url_reserve_many(imdb_id, [(sn, ep, f"{base_slug_episode_name}-{sn}-{ep}") for sn, aired in season_eps for ep in aired]) if imdb_id else {}
+    return [(sn, [(ep, (locations.get((sn, ep)) or {}).get('rel_path')) for ep in aired]) for sn, aired in season_eps]
+
+def build_episodes_html(name_en: str, year: str, seasons: List[Dict[str, Any]], tmdb_id: Optional[int] = None, imdb_id: Optional[str] = None,
+                        links: Optional[List[Tuple[int, List[Tuple[int, Optional[str]]]]]] = None) -> str:
+    base_slug_episode_name = slugify(name_en or '')
+    if links is None:
+        links = episode_links(name_en, load_series_metadata(tmdb_id, seasons), imdb_id)
     parts = []
-    if date_prefix:
-        date_prefix = date_prefix.rstrip('/')
-    for s in (seasons or []):
-        sn = s.get('season_number')
-        if sn is None or sn == 0:
-            continue
-        episode_count = s.get('episode_count')
-        if (not episode_count or episode_count == 0) and tmdb_id:
-            try:
-                resp = requests.get(f"{TMDB_BASE}/tv/{tmdb_id}/season/{sn}", params={'api_key': TMDB_API_KEY}, timeout=15)
-                if resp.status_code == 200:
-                    sec = resp.json()
-                    episode_count = len(sec.get('episodes', []))
-            except Exception:
-                episode_count = 0
-        episode_count = episode_count or 0
+    for sn, episodes in links:
         details = ['<details class="season">', f'<summary>الموسم {sn}</summary>', '<div class="episodes">']
-        for ep in range(1, episode_count + 1):
-            ep_slug = f"{base_slug_episode_name}-{sn}-{ep}"
-            link = f"{date_prefix}/{ep_slug}.html" if date_prefix else f"/{ep_slug}.html"
+        for ep, rel_path in episodes:
+            link = page_link(rel_path) if rel_path else f"/{base_slug_episode_name}-{sn}-{ep}.html"
             details.append(f'<a href="{link}">الحلقة {ep}</a>')
         details.append('</div></details>')
         parts.append('\n'.join(details))
@@ -538,14 +1561,286 @@ def generate_labels(kind: str, data: Dict[str, Any], season: Optional[int] = Non
             final.append(low)
     return final
 
+# ---------------------------
+# Site targets (one fetch + context per title, rendered and written once per target)
+# ---------------------------
+_TARGET: contextvars.ContextVar = contextvars.ContextVar('site_target', default=None)
+_TARGET_POOL: Optional[ThreadPoolExecutor] = None
+
+def current_target() -> SiteTarget:
+    """Target being rendered/written on this thread; the primary outside for_each_target()."""
+    return _TARGET.get() or TARGETS[0]
+
+def _target_pool() -> ThreadPoolExecutor:
+    global _TARGET_POOL
+    if _TARGET_POOL is None:
+        _TARGET_POOL = ThreadPoolExecutor(max_workers=max(1, TARGET_WORKERS), thread_name_prefix='target')
+    return _TARGET_POOL
+
+def _run_in_target(target: SiteTarget, fn, *args):
+    token = _TARGET.set(target)
+    try:
+        return fn(target, *args)
+    except Exception:
+        logging.exception('Target %s failed', target.name)
+        return None
+    finally:
+        _TARGET.reset(token)
+
+def for_each_target(targets: List[SiteTarget], fn, *args) -> Dict[str, Any]:
+    """
+    Run fn(target, *args) for every target, in parallel on the target pool when there is more than one.
+    Template, asset, image and link URLs resolve against the target while fn runs (see current_target).
+    Returns {target name: result}; a target whose fn raised maps to None.
+    """
+    if len(targets) == 1:
+        return {targets[0].name: _run_in_target(targets[0], fn, *args)}
+    futures = {t.name: _target_pool().submit(_run_in_target, t, fn, *args) for t in targets}
+    return {name: fut.result() for name, fut in futures.items()}
+
 # ---------------------------
 # Static site writer (replacement for Blogger API)
 # ---------------------------
 def _ensure_site_dirs(post_path: Path):
     post_path.parent.mkdir(parents=True, exist_ok=True)
 
-def _git_commit_and_push(repo_path: str, message: str) -> bool:
-    """Run git add/commit/push. Return True on success."""
+_COMPRESS_POOL: Optional[ThreadPoolExecutor] = None
+
+def _compress_pool() -> ThreadPoolExecutor:
+    global _COMPRESS_POOL
+    if _COMPRESS_POOL is None:
+        _COMPRESS_POOL = ThreadPoolExecutor(max_workers=max(1, COMPRESS_WORKERS), thread_name_prefix='compress')
+    return _COMPRESS_POOL
+
+def _gzip_bytes(data: bytes) -> bytes:
+    # mtime=0 keeps the output deterministic so unchanged pages produce no git diff
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+def _brotli_bytes(data: bytes) -> bytes:
+    return brotli.compress(data, quality=BROTLI_LEVEL, mode=brotli.MODE_TEXT)
+
+_SIDECAR_COMPRESSORS = {'gz': _gzip_bytes, 'br': _brotli_bytes}
+
+_PRECOMPRESS_FORMATS: Optional[List[str]] = None
+
+def _precompress_formats() -> List[str]:
+    global _PRECOMPRESS_FORMATS
+    if _PRECOMPRESS_FORMATS is not None:
+        return _PRECOMPRESS_FORMATS
+    formats = []
+    for ext in PRECOMPRESS:
+        if ext not in _SIDECAR_COMPRESSORS:
+            logging.warning('Unknown PRECOMPRESS format %r ignored.', ext)
+            continue
+        if ext == 'br' and brotli is None:
+            logging.warning('PRECOMPRESS=br requested but the brotli module is not installed; skipping .br sidecars.')
+            continue
+        if ext not in formats:
+            formats.append(ext)
+    _PRECOMPRESS_FORMATS = formats
+    return formats
+
+def _atomic_write_bytes(path: Path, data: bytes):
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    tmp_path.replace(path)
+
+def _page_files(post_path: Path, data: bytes) -> Tuple[List[Tuple[Path, bytes]], List[Path]]:
+    """
+    (files to write, sidecars to remove) that bring a page and its precompressed sidecars up to date.
+    - Sidecars are compressed in parallel and listed before the page itself, so an existing page
+      with identical content implies its sidecars are current.
+    - Both lists are empty when the page and all wanted sidecars are already up to date.
+    """
+    formats = _precompress_formats()
+    sidecars = {ext: post_path.with_name(f"{post_path.name}.{ext}") for ext in _SIDECAR_COMPRESSORS}
+    unchanged = False
+    try:
+        # only a page of the same size can be unchanged; then compare the bytes themselves
+        if os.stat(post_path).st_size == len(data):
+            with open(post_path, 'rb') as f:
+                unchanged = f.read() == data
+    except OSError:
+        unchanged = False
+    if unchanged:
+        formats = [ext for ext in formats if not sidecars[ext].exists()]
+    futures = {ext: _compress_pool().submit(_SIDECAR_COMPRESSORS[ext], data) for ext in formats}
+    files = []
+    for ext, fut in futures.items():
+        compressed = fut.result()
+        _stage_bytes(f'write .{ext}', len(compressed))
+        files.append((sidecars[ext], compressed))
+    if unchanged:
+        return files, []
+    # drop sidecars of formats that are no longer enabled so they can't serve stale content
+    stale = [side_path for ext, side_path in sidecars.items() if ext not in futures and side_path.exists()]
+    files.append((post_path, data))
+    return files, stale
+
+def _remove_files(paths: Iterable[Path]):
+    for path in paths:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logging.warning('Failed to remove stale sidecar %s', path)
+
+def _write_page_files(post_path: Path, data: bytes) -> bool:
+    """
+    Atomically write a page plus its precompressed sidecars (.html.gz / .html.br), one file at a time.
+    Returns False when the page and all wanted sidecars were already up to date.
+    """
+    files, stale = _page_files(post_path, data)
+    if not files:
+        return False
+    for path, blob in files:
+        if path == post_path:
+            _remove_files(stale)
+        _atomic_write_bytes(path, blob)
+    return True
+
+_WRITE_POOL: Optional[ThreadPoolExecutor] = None
+
+def _write_pool() -> ThreadPoolExecutor:
+    global _WRITE_POOL
+    if _WRITE_POOL is None:
+        _WRITE_POOL = ThreadPoolExecutor(max_workers=max(1, WRITE_WORKERS), thread_name_prefix='write')
+    return _WRITE_POOL
+
+def _fsync_path(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _write_marker(path: Path, data: Dict[str, Any], sync: bool):
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    tmp_path.replace(path)
+    if sync:
+        _fsync_path(path.parent)
+
+_BATCH_MARKER_RE = re.compile(r'\.page-batch-([0-9a-f]+)\.(pending|commit)')
+
+def _finish_page_batch(root: Path, batch_id: str, sync: bool):
+    """Roll a batch forward (commit marker present) or back (only the pending marker), then drop its markers."""
+    commit_marker, pending_marker = root / f".page-batch-{batch_id}.commit", root / f".page-batch-{batch_id}.pending"
+    if commit_marker.exists():
+        with open(commit_marker, encoding='utf-8') as f:
+            marker = json.load(f)
+        for tmp, dst in marker['renames']:
+            if (root / tmp).exists():
+                os.replace(root / tmp, root / dst)
+        _remove_files(root / p for p in marker.get('remove', []))
+        if sync:
+            for d in {(root / dst).parent for _, dst in marker['renames']}:
+                _fsync_path(d)
+    elif pending_marker.exists():
+        with open(pending_marker, encoding='utf-8') as f:
+            marker = json.load(f)
+        _remove_files(root / tmp for tmp in marker['staged'])
+    for marker_path in (commit_marker, pending_marker):
+        _remove_files([marker_path])
+
+def recover_page_batches(site_dir: str) -> int:
+    """Complete or undo PageBatch commits interrupted by a crash (run before writing to site_dir)."""
+    root = Path(site_dir)
+    if not root.is_dir():
+        return 0
+    batch_ids = {m.group(1) for m in (_BATCH_MARKER_RE.fullmatch(name) for name in os.listdir(root)) if m}
+    for batch_id in batch_ids:
+        rolled_forward = (root / f".page-batch-{batch_id}.commit").exists()
+        _finish_page_batch(root, batch_id, FSYNC_MODE == 'batch')
+        logging.warning('Recovered interrupted page batch %s in %s (%s)', batch_id, site_dir, 'rolled forward' if rolled_forward else 'rolled back')
+    return len(batch_ids)
+
+class PageBatch:
+    """
+    Group-commit writer for many pages of one site dir.
+    - add() only buffers; commit() stages every changed page and sidecar as a temp file next to its
+      target from the write pool, fsyncs the files and then their directories as a group, records a
+      commit marker and renames everything into place.
+    - All or nothing: a crash before the commit marker is durable leaves only temp files, which
+      recover_page_batches() deletes; after it, recovery finishes the renames.
+    """
+
+    def __init__(self, site_dir: str):
+        self.site_dir = site_dir
+        self.pages: Dict[str, bytes] = {}
+
+    def __len__(self):
+        return len(self.pages)
+
+    def add(self, rel_path: str, data: bytes):
+        self.pages[rel_path] = data
+
+    def commit(self) -> int:
+        """Write the buffered pages; returns how many changed. The batch is empty afterwards."""
+        pages, self.pages = self.pages, {}
+        if not pages:
+            return 0
+        root = Path(self.site_dir)
+        sync = FSYNC_MODE == 'batch'
+        with _stage('write'):
+            prepared = list(_write_pool().map(lambda item: (item[0],) + _page_files(root / item[0], item[1]), pages.items()))
+            changed = sum(1 for rel_path, files, _ in prepared if files and files[-1][0] == root / rel_path)
+            writes = [(path, blob) for _, files, _ in prepared for path, blob in files]
+            remove = [path for _, _, stale in prepared for path in stale]
+            if not writes:
+                return 0
+            _stage_bytes('write', sum(len(blob) for rel_path, files, _ in prepared for path, blob in files if path == root / rel_path))
+            batch_id = os.urandom(6).hex()
+            staged = [(path, path.with_name(f"{path.name}.{batch_id}.tmp"), blob) for path, blob in writes]
+
+            def rel(path: Path) -> str:
+                return path.relative_to(root).as_posix()
+
+            pending_marker = root / f".page-batch-{batch_id}.pending"
+            _write_marker(pending_marker, {'staged': [rel(tmp) for _, tmp, _ in staged]}, sync)
+
+            dirs = {path.parent for path, _, _ in staged}
+            sync_dirs = set(dirs)
+            for d in dirs:
+                while not d.exists():
+                    # a new directory is only durable once its parent's entry is synced too
+                    sync_dirs.add(d.parent)
+                    d = d.parent
+            for d in dirs:
+                d.mkdir(parents=True, exist_ok=True)
+
+            def stage(item):
+                path, tmp, blob = item
+                with open(tmp, 'wb') as f:
+                    f.write(blob)
+                    if sync:
+                        f.flush()
+                        os.fsync(f.fileno())
+
+            try:
+                list(_write_pool().map(stage, staged))
+                if sync:
+                    list(_write_pool().map(_fsync_path, sync_dirs))
+                _write_marker(root / f".page-batch-{batch_id}.commit",
+                              {'renames': [(rel(tmp), rel(path)) for path, tmp, _ in staged], 'remove': [rel(p) for p in remove]}, sync)
+            except BaseException:
+                _finish_page_batch(root, batch_id, False)  # rolls back unless the commit marker made it
+                raise
+            # committed: from here a crash is rolled forward by recover_page_batches()
+            _finish_page_batch(root, batch_id, sync)
+        return changed
+
+def _git_commit_and_push(repo_path: str, message: str, remote: Optional[str] = None) -> bool:
+    """Run git add/commit/push (to remote's HEAD when given, else the upstream). Return True on success."""
+    if DRY_RUN:
+        _STAGE_STATS.setdefault('git (skip)', [0, 0.0, 0])[0] += 1
+        return True
     try:
         subprocess.check_call(['git', 'add', '-A'], cwd=repo_path)
         try:
@@ -553,12 +1848,76 @@ def _git_commit_and_push(repo_path: str, message: str) -> bool:
         except subprocess.CalledProcessError as e:
             # commit returns non-zero if no changes -> ignore
             logging.debug('git commit returned non-zero (maybe no changes): %s', e)
-        subprocess.check_call(['git', 'push'], cwd=repo_path)
+        subprocess.check_call(['git', 'push', remote, 'HEAD'] if remote else ['git', 'push'], cwd=repo_path)
         return True
     except Exception:
         logging.exception('Git commit/push failed for repo %s', repo_path)
         return False
 
+# ---------------------------
+# Post-render stage: minification + shared assets
+# ---------------------------
+_MINIFY_PRESERVE_RE = re.compile(r'<(script|pre|textarea)\b[^>]*>.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_JSONLD_RE = re.compile(r'^(<script\b[^>]*application/ld\+json[^>]*>)(.*?)(</script\s*>)$', re.IGNORECASE | re.DOTALL)
+_HTML_COMMENT_RE = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+_WHITESPACE_RE = re.compile(r'\s+')
+# whitespace around block-level tags never renders, so it can be dropped entirely
+_BLOCK_TAG_WS_RE = re.compile(r'\s*(</?(?:html|head|body|div|ul|ol|li|h[1-6]|p|details|summary|meta|title|link|br)\b[^>]*>)\s*', re.IGNORECASE)
+
+def _minify_jsonld(segment: str) -> str:
+    m = _JSONLD_RE.match(segment)
+    if not m:
+        return segment
+    try:
+        compact = json.dumps(json.loads(m.group(2)), ensure_ascii=False, separators=(',', ':'))
+    except ValueError:
+        return segment
+    return m.group(1) + compact + m.group(3)
+
+def _minify_markup(text: str) -> str:
+    text = _HTML_COMMENT_RE.sub('', text)
+    text = _WHITESPACE_RE.sub(' ', text)
+    return _BLOCK_TAG_WS_RE.sub(r'\1', text)
+
+def minify_html(html: str) -> str:
+    """Collapse insignificant whitespace and compact inline JSON-LD; <script>/<pre>/<textarea> bodies are kept as-is."""
+    out = []
+    pos = 0
+    for m in _MINIFY_PRESERVE_RE.finditer(html):
+        out.append(_minify_markup(html[pos:m.start()]))
+        out.append(_minify_jsonld(m.group(0)))
+        pos = m.end()
+    out.append(_minify_markup(html[pos:]))
+    return ''.join(out).strip()
+
+_SHARED_ASSET_URLS: Dict[str, Dict[str, str]] = {}
+
+def _site_base_path(target: Optional[SiteTarget] = None) -> str:
+    # path component of the public URL, so project pages (user.github.io/repo) resolve assets correctly
+    base_url = (target or current_target()).base_url
+    return urlparse(base_url).path.rstrip('/') if base_url else ''
+
+def shared_asset_files() -> Dict[str, Tuple[str, bytes]]:
+    """Current content-hashed file name and bytes of each shared asset, keyed by extension."""
+    search_rel = os.path.relpath(SEARCH_INDEX_SUBDIR, ASSETS_SUBDIR).replace(os.sep, '/')
+    data = SHARED_JS.replace('__SEARCH_REL__', json.dumps(search_rel)).strip().encode('utf-8')
+    return {'js': (f"site.{hashlib.sha256(data).hexdigest()[:12]}.js", data)}
+
+def ensure_shared_assets(site_dir: Optional[str] = None) -> Dict[str, str]:
+    """Write the shared assets under content-hashed names (once per process) and return their URLs keyed by extension."""
+    site_dir = site_dir or current_target().site_dir
+    cached = _SHARED_ASSET_URLS.get(site_dir)
+    if cached is not None:
+        return cached
+    urls = {}
+    asset_dir = Path(site_dir) / ASSETS_SUBDIR
+    asset_dir.mkdir(parents=True, exist_ok=True)
+    for ext, (name, data) in shared_asset_files().items():
+        _write_page_files(asset_dir / name, data)
+        urls[ext] = f"{_site_base_path()}/{ASSETS_SUBDIR}/{name}"
+    _SHARED_ASSET_URLS[site_dir] = urls
+    return urls
+
 def _render_full_html(title: str, description: str, content_html: str, labels: Optional[List[str]] = None, schema_json: Optional[str] = None):
     labels_meta = ','.join(labels or [])
     head = f"""<!doctype html>
@@ -570,66 +1929,214 @@ def _render_full_html(title: str, description: str, content_html: str, labels: O
 <meta name="description" content="{escape(description or '')}">
 <meta name="keywords" content="{escape(labels_meta)}">
 """
+    if SHARED_ASSETS:
+        assets = ensure_shared_assets()
+        head += f'<script src="{assets["js"]}" defer></script>\n'
     if schema_json:
         head += f"<script type='application/ld+json'>{schema_json}</script>\n"
     head += "</head>\n<body>\n"
     tail = "\n</body>\n</html>"
-    return head + content_html + tail
-
-def create_post_and_patch(service_unused, blog_id: str, temp_title: str, final_title: str, content_html: str, labels: Optional[List[str]] = None, description: Optional[str] = None):
+    full_html = head + content_html + tail
+    if MINIFY_HTML:
+        raw_size = len(full_html.encode('utf-8'))
+        full_html = minify_html(full_html)
+        min_size = len(full_html.encode('utf-8'))
+        logging.info('Minified page %r: %s -> %s bytes (saved %s)', title, raw_size, min_size, raw_size - min_size)
+    return full_html
+
+def create_post_and_patch(service_unused, blog_id: str, temp_title: str, final_title: str, content_html: str, labels: Optional[List[str]] = None, description: Optional[str] = None, full_html: Optional[str] = None, rel_path: Optional[str] = None):
     """
     Replacement for Blogger API:
-    - Writes static file to SITE_DIR/YYYY/MM/slug.html
-    - Commits and pushes to git repo at SITE_DIR
-    - Returns (post_id, post_url) where post_id is slug and post_url constructed from GITHUB_PAGES_URL (if set)
+    - Writes static file to <site_dir>/YYYY/MM/[<h2>/]slug.html (see SITE_LAYOUT; plus .gz/.br sidecars when PRECOMPRESS is set)
+      of the current target (SITE_DIR outside for_each_target)
+    - rel_path, when given, is the location reserved in url_index (relative to the site dir) and is used as-is
+    - Commits and pushes the target's git repo (to its git_remote when set)
+    - full_html, when given, is an already rendered page (e.g. from an episode skeleton) written as-is
+    - Returns (post_id, post_url) where post_id is slug and post_url constructed from the target's base_url (if set)
     """
+    target = current_target()
     try:
         now = datetime.now(timezone.utc)
-        year = f"{now.year:04d}"
-        month = f"{now.month:02d}"
-
-        slug = (temp_title or '').strip()
-        if not slug:
-            slug = slugify(final_title) or f"post-{int(now.timestamp())}"
-
-        filename = f"{slug}.html"
-        post_dir = Path(SITE_DIR) / year / month
-        post_path = post_dir / filename
+        if not rel_path:
+            slug = (temp_title or '').strip()
+            if not slug:
+                slug = slugify(final_title) or f"post-{int(now.timestamp())}"
+            rel_path = page_rel_path(f"{now.year:04d}/{now.month:02d}", slug)
+        slug = Path(rel_path).stem
+        post_path = Path(target.site_dir) / rel_path
 
         _ensure_site_dirs(post_path)
 
-        # if JSON-LD already prefixed inside content_html, we don't need to pass schema_json
-        full_html = _render_full_html(final_title, description or '', content_html, labels=labels, schema_json=None)
+        if full_html is None:
+            # if JSON-LD already prefixed inside content_html, we don't need to pass schema_json
+            with _stage('render'):
+                full_html = _render_full_html(final_title, description or '', content_html, labels=labels, schema_json=None)
 
-        tmp_path = post_path.with_suffix('.tmp')
-        with open(tmp_path, 'w', encoding='utf-8') as f:
-            f.write(full_html)
-        tmp_path.replace(post_path)
+        page_bytes = full_html.encode('utf-8')
+        with _stage('write'):
+            changed = _write_page_files(post_path, page_bytes)
+        _stage_bytes('write', len(page_bytes))
+        if not changed:
+            logging.info('Static post %s unchanged; skipped rewrite.', post_path)
 
-        commit_msg = f"Add post {slug} ({year}/{month}) by {AUTHOR_NAME}"
-        ok = _git_commit_and_push(SITE_DIR, commit_msg)
+        commit_msg = f"Add post {slug} ({Path(rel_path).parent.as_posix()}) by {AUTHOR_NAME}"
+        ok = _git_commit_and_push(target.site_dir, commit_msg, target.git_remote)
 
         post_id = slug
-        if GITHUB_PAGES_URL:
-            post_url = f"{GITHUB_PAGES_URL.rstrip('/')}/{year}/{month}/{filename}"
-        else:
-            post_url = str(post_path.resolve())
+        post_url = _page_url(rel_path, target)
 
-        try:
-            global PUBLISHED_THIS_CYCLE
-            PUBLISHED_THIS_CYCLE += 1
-            logging.info('Incremented published counter -> %s', PUBLISHED_THIS_CYCLE)
-        except Exception:
-            logging.exception('Failed to increment published counter.')
+        if target is TARGETS[0]:
+            # mirrors don't count: MAX_PUBLISH_PER_CYCLE is about titles, not copies
+            try:
+                global PUBLISHED_THIS_CYCLE
+                PUBLISHED_THIS_CYCLE += 1
+                logging.info('Incremented published counter -> %s', PUBLISHED_THIS_CYCLE)
+            except Exception:
+                logging.exception('Failed to increment published counter.')
 
-        logging.info('Created static post: %s -> %s (git_push=%s)', slug, post_url, ok)
+        logging.info('Created static post: %s -> %s (target=%s, git_push=%s)', slug, post_url, target.name, ok)
         return post_id, post_url
     except Exception:
         logging.exception('Failed to create static post for %s', final_title)
         return None, None
 
+# ---------------------------
+# Client-side search index (prefix-sharded JSON under SITE_DIR/search)
+# ---------------------------
+# Layout: search/index.json lists the shard names; search/<shard>.json holds
+#   {"tokens": {token: [imdb_id, ...]}, "docs": {imdb_id: [name, year, content_type, labels, url]}}
+# for every token whose first SEARCH_PREFIX_LEN characters map to that shard. Only movie and
+# series roots are indexed; publishing a title rewrites just the shards its tokens fall into.
+# Tokens come from the name only: the year is a doc field the client filters on, since as a token
+# it would put nearly every title into the '19'/'20' shards.
+SEARCH_INDEX_SUBDIR = os.environ.get('SEARCH_INDEX_SUBDIR', 'search')
+SEARCH_PREFIX_LEN = int(os.environ.get('SEARCH_PREFIX_LEN', '2'))
+SEARCH_INDEX_VERSION = 2  # bumped when the shard contents change; older indexes are rebuilt at startup
+
+_ARABIC_DIACRITICS_RE = re.compile(r'[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_ARABIC_WORD_RE = re.compile(r'[\u0621-\u064a]+')
+_ARABIC_FOLD = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ة': 'ه', 'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ی': 'ي', 'ک': 'ك'})
+
+def search_tokens(text: str) -> List[str]:
+    """Latin tokens via the slugify/unidecode path (also transliterates Arabic), plus folded Arabic words."""
+    tokens: List[str] = []
+    for t in slugify(text).split('-'):
+        if t and t not in tokens:
+            tokens.append(t)
+    folded = _ARABIC_DIACRITICS_RE.sub('', text or '').translate(_ARABIC_FOLD)
+    for t in _ARABIC_WORD_RE.findall(folded):
+        if t not in tokens:
+            tokens.append(t)
+    return tokens
+
+def _search_shard_name(token: str) -> str:
+    prefix = token[:SEARCH_PREFIX_LEN]
+    if prefix.isascii() and prefix.isalnum():
+        return prefix
+    # non-latin prefixes are hex encoded to keep file names portable (client: TextEncoder -> hex)
+    return 'u' + prefix.encode('utf-8').hex()
+
+def _search_doc(record: Dict[str, Any]) -> List[Any]:
+    labels = record.get('labels') or []
+    if isinstance(labels, str):
+        labels = [l for l in labels.split(',') if l]
+    return [record.get('name') or '', record.get('year') or '', record.get('content_type') or '', list(labels), record.get('url') or '']
+
+def _search_dir(site_dir: str) -> Path:
+    return Path(site_dir) / SEARCH_INDEX_SUBDIR
+
+def _load_search_json(path: Path, default: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def _dump_search_json(path: Path, data: Dict[str, Any]):
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    _write_page_files(path, payload)
+
+def _write_search_manifest(site_dir: str, shard_names: Iterable[str]):
+    _dump_search_json(_search_dir(site_dir) / 'index.json',
+                      {'version': SEARCH_INDEX_VERSION, 'prefix_len': SEARCH_PREFIX_LEN, 'shards': sorted(set(shard_names))})
+
+def search_index_current(site_dir: str) -> bool:
+    manifest = _load_search_json(_search_dir(site_dir) / 'index.json', {})
+    return manifest.get('version') == SEARCH_INDEX_VERSION and manifest.get('prefix_len') == SEARCH_PREFIX_LEN
+
+def search_index_add(record: Dict[str, Any], site_dir: str = SITE_DIR):
+    """Add one published movie/series root to the search index, touching only its own shards."""
+    try:
+        if record.get('season') is not None or record.get('episode') is not None:
+            return
+        imdb_id = record.get('imdb_id')
+        tokens = search_tokens(record.get('name') or '')
+        if not imdb_id or not tokens:
+            return
+        sdir = _search_dir(site_dir)
+        sdir.mkdir(parents=True, exist_ok=True)
+        by_shard: Dict[str, List[str]] = {}
+        for t in tokens:
+            by_shard.setdefault(_search_shard_name(t), []).append(t)
+        doc = _search_doc(record)
+        for shard_name, shard_tokens in by_shard.items():
+            path = sdir / f"{shard_name}.json"
+            shard = _load_search_json(path, {'tokens': {}, 'docs': {}})
+            for t in shard_tokens:
+                ids = shard['tokens'].setdefault(t, [])
+                if imdb_id not in ids:
+                    ids.append(imdb_id)
+            shard['docs'][imdb_id] = doc
+            _dump_search_json(path, shard)
+        manifest = _load_search_json(sdir / 'index.json', {'shards': []})
+        if not set(by_shard) <= set(manifest.get('shards') or []):
+            _write_search_manifest(site_dir, list(manifest.get('shards') or []) + list(by_shard))
+    except Exception:
+        logging.exception('Failed to update search index for %s', record.get('imdb_id'))
+
+def rebuild_search_index(site_dir: str = SITE_DIR, db_path: str = DB_PATH, target: Optional[SiteTarget] = None) -> int:
+    """Rebuild every shard from the published rows of target (default: the primary). Returns the number of indexed titles."""
+    shards: Dict[str, Dict[str, Any]] = {}
+    count = 0
+    conn = sqlite3.connect(db_path)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT imdb_id, content_type, name, year, url, labels FROM published WHERE season IS NULL AND episode IS NULL AND IFNULL(target, '')=? ORDER BY id",
+                    (_target_key(target or TARGETS[0]),))
+        for imdb_id, content_type, name, year, url, labels in cur:
+            record = {'imdb_id': imdb_id, 'content_type': content_type, 'name': name, 'year': year, 'url': url, 'labels': labels}
+            doc = _search_doc(record)
+            count += 1
+            for t in search_tokens(name or ''):
+                shard = shards.setdefault(_search_shard_name(t), {'tokens': {}, 'docs': {}})
+                ids = shard['tokens'].setdefault(t, [])
+                if imdb_id not in ids:
+                    ids.append(imdb_id)
+                shard['docs'][imdb_id] = doc
+    finally:
+        conn.close()
+    sdir = _search_dir(site_dir)
+    sdir.mkdir(parents=True, exist_ok=True)
+    for shard_name, shard in shards.items():
+        _dump_search_json(sdir / f"{shard_name}.json", shard)
+    for old in sdir.glob('*.json'):
+        if old.name != 'index.json' and old.stem not in shards:
+            old.unlink()
+    _write_search_manifest(site_dir, shards)
+    logging.info('Rebuilt search index: %s titles in %s shards', count, len(shards))
+    return count
+
 def random_sleep_after_publish():
     sleep_for = random.randint(RATE_MIN, RATE_MAX)
+    if DRY_RUN:
+        # report what a real run would have slept instead of sleeping
+        stats = _STAGE_STATS.setdefault('sleep (skip)', [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += sleep_for
+        return
+    if sleep_for >= BOOKKEEPING_BATCH_SECONDS:
+        # nothing else will happen for a while: don't leave pages uncommitted across the sleep
+        flush_bookkeeping()
     logging.info('Sleeping %s seconds before next publish...', sleep_for)
     time.sleep(sleep_for)
 
@@ -701,264 +2208,624 @@ def build_jsonld_schema(kind: str, data: Dict[str, Any], imdb_id: str, season: O
     return schema
 
 # ---------------------------
-# Publishing helpers (unchanged)
+# Poster images
 # ---------------------------
-def publish_missing_episodes(imdb_id: str, tmdb_id: int, name_use: str, year: str, seasons_list: List[Dict[str, Any]], data_ar: Dict[str, Any], data_en: Dict[str, Any], root_date_prefix: str, service):
-    logging.info('Publishing missing episodes for %s', imdb_id)
-    for s in seasons_list:
-        sn = s.get('season_number')
-        if sn is None or sn == 0:
+_IMAGE_POOL: Optional[ThreadPoolExecutor] = None
+# (site_dir, poster_path) -> sources, least recently used first; bounded so RUN_FOREVER processes stay flat
+_POSTER_SOURCES: 'OrderedDict[Tuple[str, str], Dict[str, str]]' = OrderedDict()
+# in-flight fetches (by poster path) and localizations (by (site_dir, poster_path)): targets and episodes
+# asking for the same poster at once share one fetch/encode, other posters are not held up by it
+_POSTER_INFLIGHT: Dict[Any, Future] = {}
+_POSTER_LOCK = threading.Lock()  # guards _POSTER_SOURCES and _POSTER_INFLIGHT only, never held across I/O
+_POSTER_FAILED: Dict[str, float] = {}  # poster path -> time.monotonic() of its last failed fetch
+_POSTER_ENCODE_OPTIONS = {'webp': {'quality': 80, 'method': 6}, 'avif': {'quality': 60}}
+
+def _image_pool() -> ThreadPoolExecutor:
+    global _IMAGE_POOL
+    if _IMAGE_POOL is None:
+        _IMAGE_POOL = ThreadPoolExecutor(max_workers=max(1, IMAGE_WORKERS), thread_name_prefix='image')
+    return _IMAGE_POOL
+
+_POSTER_VARIANT_FORMATS: Optional[List[str]] = None
+
+def _poster_variant_formats() -> List[str]:
+    global _POSTER_VARIANT_FORMATS
+    if _POSTER_VARIANT_FORMATS is not None:
+        return _POSTER_VARIANT_FORMATS
+    formats = []
+    for fmt in POSTER_FORMATS:
+        if fmt not in _POSTER_ENCODE_OPTIONS:
+            logging.warning('Unknown POSTER_FORMATS entry %r ignored.', fmt)
             continue
-        ep_count = s.get('episode_count') or 0
-        if ep_count == 0 and tmdb_id:
-            try:
-                resp = requests.get(f"{TMDB_BASE}/tv/{tmdb_id}/season/{sn}", params={'api_key': TMDB_API_KEY}, timeout=15)
-                if resp.status_code == 200:
-                    sec = resp.json()
-                    ep_count = len(sec.get('episodes', []))
-            except Exception:
-                logging.exception('Failed to fetch season detail for %s season %s', imdb_id, sn)
-                ep_count = 0
-        logging.info('Season %s has %s episodes (imdb=%s)', sn, ep_count, imdb_id)
-        for ep in range(1, ep_count + 1):
-            if db_has(imdb_id, sn, ep):
-                continue
-            image_url = 'https://image.tmdb.org/t/p/w780' + ((data_en.get('poster_path') or '') or '')
-            embed_server1 = f'https://vidsrc.xyz/embed/tv/{imdb_id}/{sn}/{ep}'
-            embed_server2 = f'https://vidsrc.to/embed/tv/{imdb_id}/{sn}/{ep}'
-            episodes_html = build_episodes_html(name_use, year, seasons_list, tmdb_id, date_prefix=root_date_prefix)
-            context = {
-                'image_url': image_url,
-                'name': name_use,
-                'year': year,
-                'content_type': 'مسلسل',
-                'country': (data_ar.get('production_countries') or [{}])[0].get('name', ''),
-                'lang': data_en.get('original_language', ''),
-                'category': ', '.join([g.get('name') for g in (data_ar.get('genres') or [])]),
-                'imdb_rating': data_en.get('vote_average') or data_ar.get('vote_average') or '',
-                'release_date': data_ar.get('release_date') or data_ar.get('first_air_date') or '',
-                'show_time': data_ar.get('runtime') or (data_ar.get('episode_run_time')[0] if data_ar.get('episode_run_time') else ''),
-                'story': data_ar.get('overview') or data_en.get('overview') or '',
-                'embed_server1': embed_server1,
-                'embed_server2': embed_server2,
-                'episodes_html': episodes_html,
-                'search_spans': build_search_spans(name_use, year, True)
-            }
-            html_content = Template(HTML_TEMPLATE).render(**context)
+        if Image is None:
+            logging.warning('POSTER_FORMATS=%s requested but Pillow is not installed; serving the original poster only.', fmt)
+            continue
+        if not pil_features.check(fmt):
+            logging.warning('This Pillow build cannot encode %s; skipping %s poster variants.', fmt, fmt)
+            continue
+        if fmt not in formats:
+            formats.append(fmt)
+    _POSTER_VARIANT_FORMATS = formats
+    return formats
+
+def _fetch_poster_original(poster_path: str) -> Optional[Tuple[str, bytes]]:
+    """(sha256, bytes) of a TMDB poster, from POSTER_CACHE_DIR when it was fetched before."""
+    ext = Path(poster_path).suffix.lower() or '.jpg'
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        row = conn.execute('SELECT sha256 FROM poster_cache WHERE poster_path=?', (poster_path,)).fetchone()
+    finally:
+        conn.close()
+    if row:
+        for cache_dir in filter(None, (POSTER_CACHE_DIR, POSTER_CACHE_LIVE_DIR)):
             try:
-                schema = build_jsonld_schema('tv', data_en or data_ar, imdb_id, sn, ep)
-            except Exception:
-                schema = None
-            content_with_schema = (f"<script type='application/ld+json'>{json.dumps(schema, ensure_ascii=False)}</script>\n" if schema else "") + html_content
-            ep_slug = f"{slugify(name_use)}-{sn}-{ep}"
-            temp_title = ep_slug
-            final_title = f"مشاهده مسلسل {name_use} الموسم {sn} الحلقه {ep} مترجم - ايجی بست"
-            description = f"مشاهده و تنزيل مسلسل {name_use} الموسم {sn} الحلقه {ep}"
-            labels = generate_labels('tv', data_ar or data_en, sn, ep)
-            labels = [l for l in labels if isinstance(l, str) and l.strip()]
-            ordered = []
-            if 'en' in labels:
-                ordered.append('en'); labels.remove('en')
-            base = 'series'
-            if base in labels:
-                ordered.append(base); labels.remove(base)
-            ordered.extend(labels)
-            ordered.append(random.choice(['hd', 'hdtv']))
-            labels = ordered
+                with open(Path(cache_dir) / f"{row[0]}{ext}", 'rb') as f:
+                    return row[0], f.read()
+            except OSError:
+                pass
+        logging.info('Cached poster %s missing on disk; refetching.', poster_path)
+    resp = requests.get(f"{TMDB_IMAGE_BASE}/{POSTER_SOURCE_SIZE}{poster_path}", timeout=30)
+    if resp.status_code != 200 or not resp.content:
+        logging.warning('Poster fetch %s failed: %s', poster_path, resp.status_code)
+        return None
+    data = resp.content
+    sha = hashlib.sha256(data).hexdigest()
+    cache_dir = Path(POSTER_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    if not (cache_dir / f"{sha}{ext}").exists():
+        _atomic_write_bytes(cache_dir / f"{sha}{ext}", data)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute('INSERT OR REPLACE INTO poster_cache (poster_path, sha256, fetched_at) VALUES (?, ?, ?)',
+                     (poster_path, sha, datetime.now(timezone.utc).isoformat()))
+        conn.commit()
+    finally:
+        conn.close()
+    return sha, data
+
+def _encode_poster(data: bytes, width: int, fmt: str) -> bytes:
+    with Image.open(io.BytesIO(data)) as im:
+        im = im.convert('RGB')
+        if im.width > width:
+            im = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+        buf = io.BytesIO()
+        im.save(buf, format=fmt.upper(), **_POSTER_ENCODE_OPTIONS[fmt])
+        return buf.getvalue()
+
+def _poster_single_flight(key: Any, fn):
+    """Run fn() once per key at a time; concurrent callers with the same key wait for and share its result."""
+    with _POSTER_LOCK:
+        fut = _POSTER_INFLIGHT.get(key)
+        owner = fut is None
+        if owner:
+            fut = _POSTER_INFLIGHT[key] = Future()
+    if not owner:
+        return fut.result()
+    try:
+        result = fn()
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    else:
+        fut.set_result(result)
+        return result
+    finally:
+        with _POSTER_LOCK:
+            _POSTER_INFLIGHT.pop(key, None)
+
+def _fetch_poster_once(poster_path: str) -> Optional[Tuple[str, bytes]]:
+    # a recent failure is not retried (per target, per episode) until POSTER_RETRY_MINUTES have passed
+    failed_at = _POSTER_FAILED.get(poster_path)
+    if failed_at is not None and time.monotonic() - failed_at < POSTER_RETRY_MINUTES * 60:
+        return None
+    try:
+        fetched = _fetch_poster_original(poster_path)
+    except Exception:
+        logging.exception('Failed to fetch poster %s', poster_path)
+        fetched = None
+    if fetched is None:
+        _POSTER_FAILED[poster_path] = time.monotonic()
+    else:
+        _POSTER_FAILED.pop(poster_path, None)
+    return fetched
+
+@_staged('images')
+def localize_poster(poster_path: str, site_dir: Optional[str] = None) -> Optional[Dict[str, str]]:
+    """
+    Serve a TMDB poster from the site itself: {'src': url, 'webp': srcset, 'avif': srcset}.
+    - Files are named by content hash, so they never change and can be cached forever.
+    - Results are memoized per site dir (default: the current target's), up to POSTER_MEMO_SIZE entries;
+      a series root and its episodes share one fetch, and so do all targets.
+    - Returns None (callers keep the TMDB URL) when disabled or the fetch fails; failures are not memoized,
+      the fetch is tried again once POSTER_RETRY_MINUTES have passed.
+    """
+    if not POSTER_CACHE or not poster_path:
+        return None
+    site_dir = site_dir or current_target().site_dir
+    key = (site_dir, poster_path)
+    with _POSTER_LOCK:
+        if key in _POSTER_SOURCES:
+            _POSTER_SOURCES.move_to_end(key)
+            return _POSTER_SOURCES[key]
+    sources = _poster_single_flight(key, lambda: _localize_poster(poster_path, site_dir))
+    if sources is not None:
+        with _POSTER_LOCK:
+            _POSTER_SOURCES[key] = sources
+            while len(_POSTER_SOURCES) > max(1, POSTER_MEMO_SIZE):
+                _POSTER_SOURCES.popitem(last=False)
+    return sources
+
+def _localize_poster(poster_path: str, site_dir: str) -> Optional[Dict[str, str]]:
+    fetched = _poster_single_flight(poster_path, lambda: _fetch_poster_once(poster_path))
+    if fetched is None:
+        return None
+    sha, data = fetched
+    stem = sha[:16]
+    ext = Path(poster_path).suffix.lower() or '.jpg'
+    out_dir = Path(site_dir) / IMAGES_SUBDIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+    base_url = f"{_site_base_path()}/{IMAGES_SUBDIR}"
+    if not (out_dir / f"{stem}{ext}").exists():
+        _atomic_write_bytes(out_dir / f"{stem}{ext}", data)
+    sources = {'src': f"{base_url}/{stem}{ext}"}
+    formats = _poster_variant_formats()
+    if formats:
+        try:
+            with Image.open(io.BytesIO(data)) as im:
+                orig_width = im.width
+        except Exception:
+            logging.warning('Poster %s is not a readable image; serving the original only.', poster_path)
+            formats = []
+        else:
+            widths = sorted({min(w, orig_width) for w in POSTER_WIDTHS if w > 0})
+    for fmt in formats:
+        jobs = {w: _image_pool().submit(_encode_poster, data, w, fmt)
+                for w in widths if not (out_dir / f"{stem}-{w}.{fmt}").exists()}
+        for w, fut in jobs.items():
             try:
-                post_id, post_url = create_post_and_patch(None, '', temp_title, final_title, content_with_schema, labels, description)
-                db_insert({
-                    'imdb_id': imdb_id,
-                    'content_type': 'tv',
-                    'name': name_use,
-                    'year': year,
-                    'season': sn,
-                    'episode': ep,
-                    'blog_post_id': post_id,
-                    'url': post_url
-                })
-                mark_imdb_published(imdb_id)
-                try:
-                    removed = remove_imdb_ids_from_txt([imdb_id], IMDB_FILE)
-                    if removed:
-                        logging.info('Removed %s from file after episode publish (removed=%s)', imdb_id, removed)
-                except Exception:
-                    logging.exception('Failed to remove imdb id from file after episode publish %s', imdb_id)
-                logging.info('Published episode S%sE%s -> %s', sn, ep, post_url)
-                random_sleep_after_publish()
+                _atomic_write_bytes(out_dir / f"{stem}-{w}.{fmt}", fut.result())
             except Exception:
-                logging.exception('Failed to create episode post for %s S%sE%s', imdb_id, sn, ep)
+                logging.exception('Failed to encode %s poster %s at %spx', fmt, poster_path, w)
+        srcset = [f"{base_url}/{stem}-{w}.{fmt} {w}w" for w in widths if (out_dir / f"{stem}-{w}.{fmt}").exists()]
+        if srcset:
+            sources[fmt] = ', '.join(srcset)
+    return sources
 
-def publish_imdb_item(imdb_id: str, season: Optional[int] = None, episode: Optional[int] = None, is_dry_run: bool = False):
-    logging.info('Processing %s (s=%s e=%s)', imdb_id, season, episode)
-    if season is None and episode is None and db_has(imdb_id, None, None):
-        logging.info('Already published (movie or tv root). Fast skip.')
-        return None
+# ---------------------------
+# Title record (compact per-title view shared by the root, movie and episode paths)
+# ---------------------------
+def _ordered_labels(kind: str, data: Dict[str, Any]) -> List[str]:
+    labels = generate_labels(kind, data, None, None)
+    labels = [l for l in labels if isinstance(l, str) and l.strip()]
+    ordered = []
+    if 'en' in labels:
+        ordered.append('en'); labels.remove('en')
+    base = 'movies' if kind == 'movie' else 'series'
+    if base in labels:
+        ordered.append(base); labels.remove(base)
+    ordered.extend(labels)
+    return ordered
+
+class TitleRecord:
+    """
+    Immutable, per-title extract of the TMDB ar/en payloads holding only what the renderers use.
+    Built once per title; the raw payloads (credits lists etc.) can be dropped right after.
+    """
+    __slots__ = ('imdb_id', 'tmdb_id', 'kind', 'name', 'year', 'image_url', 'country', 'lang', 'category',
+                 'imdb_rating', 'release_date', 'show_time', 'story', 'labels', 'schema_json', 'seasons', 'search_spans',
+                 'poster_path')
+
+    def __init__(self, **fields):
+        for k in self.__slots__:
+            object.__setattr__(self, k, fields.get(k))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'TitleRecord is immutable (tried to set {key})')
+
+    @classmethod
+    def from_tmdb(cls, imdb_id: str, kind: str, tmdb_id: int, data_ar: Dict[str, Any], data_en: Dict[str, Any]) -> 'TitleRecord':
+        data_ar = data_ar or {}
+        data_en = data_en or {}
+        name_en = (data_en.get('title') or data_en.get('name') or data_en.get('original_title') or data_en.get('original_name') or '').strip()
+        name_use = name_en or imdb_id
+        year = (data_ar.get('release_date') or data_ar.get('first_air_date') or '')[:4]
+        try:
+            schema = build_jsonld_schema(kind, data_en or data_ar, imdb_id)
+        except Exception:
+            schema = None
+        seasons = data_ar.get('seasons') or data_en.get('seasons') or []
+        poster_path = data_en.get('poster_path') or ''
+        return cls(
+            imdb_id=imdb_id,
+            tmdb_id=tmdb_id,
+            kind=kind,
+            name=name_use,
+            year=year,
+            image_url=f"{TMDB_IMAGE_BASE}/{POSTER_SOURCE_SIZE}{poster_path}",
+            country=(data_ar.get('production_countries') or [{}])[0].get('name', ''),
+            lang=data_en.get('original_language', ''),
+            category=', '.join([g.get('name') for g in (data_ar.get('genres') or [])]),
+            imdb_rating=data_en.get('vote_average') or data_ar.get('vote_average') or '',
+            release_date=data_ar.get('release_date') or data_ar.get('first_air_date') or '',
+            show_time=data_ar.get('runtime') or (data_ar.get('episode_run_time')[0] if data_ar.get('episode_run_time') else ''),
+            story=data_ar.get('overview') or data_en.get('overview') or '',
+            labels=tuple(_ordered_labels(kind, data_ar or data_en)),
+            schema_json=json.dumps(schema, ensure_ascii=False) if schema else '',
+            seasons=tuple((s.get('season_number'), s.get('episode_count')) for s in seasons),
+            search_spans=tuple(build_search_spans(name_use, year, kind == 'tv')),
+            poster_path=poster_path,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: (list(v) if isinstance(v, tuple) else v) for k in self.__slots__ for v in (getattr(self, k),)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'TitleRecord':
+        fields = dict(data)
+        fields['labels'] = tuple(fields.get('labels') or ())
+        fields['search_spans'] = tuple(fields.get('search_spans') or ())
+        fields['seasons'] = tuple(tuple(x) for x in (fields.get('seasons') or ()))
+        return cls(**fields)
+
+    @property
+    def is_tv(self) -> bool:
+        return self.kind == 'tv'
+
+    @property
+    def seasons_list(self) -> List[Dict[str, Any]]:
+        return [{'season_number': sn, 'episode_count': count} for sn, count in self.seasons]
+
+    @property
+    def schema_prefix(self) -> str:
+        return f"<script type='application/ld+json'>{self.schema_json}</script>\n" if self.schema_json else ""
+
+    def page_labels(self) -> List[str]:
+        return list(self.labels) + [random.choice(['hd', 'hdtv'])]
+
+    def context(self, **extra) -> Dict[str, Any]:
+        # posters are localized into the current target's site (image_url stays the TMDB fallback)
+        poster = localize_poster(self.poster_path) or {}
+        ctx = {
+            'image_url': poster.get('src') or self.image_url,
+            'name': self.name,
+            'year': self.year,
+            'content_type': 'مسلسل' if self.is_tv else 'فيلم',
+            'country': self.country,
+            'lang': self.lang,
+            'category': self.category,
+            'imdb_rating': self.imdb_rating,
+            'release_date': self.release_date,
+            'show_time': self.show_time,
+            'story': self.story,
+            'search_spans': self.search_spans,
+            'poster_webp': poster.get('webp'),
+            'poster_avif': poster.get('avif'),
+            'poster_sizes': POSTER_SIZES_ATTR,
+        }
+        ctx.update(extra)
+        return ctx
+
+def fetch_title(imdb_id: str) -> Optional[TitleRecord]:
+    """Resolve an IMDb id on TMDB and extract its TitleRecord (one /find + two detail calls)."""
     found = tmdb_find_by_imdb(imdb_id)
     if not found:
         logging.error('Not found on TMDB for %s', imdb_id)
         return None
     if found.get('movie_results'):
         kind = 'movie'
-        tmdb_item = found['movie_results'][0]
-        tmdb_id = tmdb_item.get('id')
+        tmdb_id = found['movie_results'][0].get('id')
     elif found.get('tv_results'):
         kind = 'tv'
-        tmdb_item = found['tv_results'][0]
-        tmdb_id = tmdb_item.get('id')
+        tmdb_id = found['tv_results'][0].get('id')
     else:
         logging.error('TMDB returned no movie or tv for %s', imdb_id)
         return None
     data_ar = tmdb_get_detail(kind, tmdb_id, lang='ar') or {}
     data_en = tmdb_get_detail(kind, tmdb_id, lang='en') or {}
-    name_en = (data_en.get('title') or data_en.get('name') or data_en.get('original_title') or data_en.get('original_name') or '').strip()
-    name_use = name_en or imdb_id
-    year = (data_ar.get('release_date') or data_ar.get('first_air_date') or '')[:4]
-    is_tv = (kind == 'tv')
-    poster_path = data_en.get('poster_path') or ''
+    return TitleRecord.from_tmdb(imdb_id, kind, tmdb_id, data_ar, data_en)
+
+# ---------------------------
+# Episode page skeletons (render the series-invariant parts once, substitute per episode)
+# ---------------------------
+_SLOT_RE = re.compile(r'\x00slot:(\w+)\x00')
+def _page_template() -> Template:
+    return current_target().template()
+
+def _slot(name: str) -> str:
+    # NUL-delimited markers survive jinja, escape() and minify_html untouched
+    return f'\x00slot:{name}\x00'
+
+def render_episode_page(context_base: Dict[str, Any], schema_prefix: str, embed_server1: str, embed_server2: str, title: str, description: str, labels: List[str]) -> str:
+    """Full renderer for one episode page: template + JSON-LD + page chrome (+ minification)."""
+    context = dict(context_base, embed_server1=embed_server1, embed_server2=embed_server2)
+    html_content = _page_template().render(**context)
+    return _render_full_html(title, description or '', schema_prefix + html_content, labels=labels, schema_json=None)
+
+def build_episode_skeleton(context_base: Dict[str, Any], schema_prefix: str) -> List[str]:
+    """Render the page once with slot markers; returns [literal, slot, literal, slot, ..., literal]."""
+    page = render_episode_page(context_base, schema_prefix, _slot('embed_server1'), _slot('embed_server2'), _slot('title'), _slot('description'), [_slot('keywords')])
+    return _SLOT_RE.split(page)
+
+def episode_slot_values(embed_server1: str, embed_server2: str, title: str, description: str, labels: List[str]) -> Dict[str, str]:
+    # the same escaping _render_full_html applies to the head fields
+    return {
+        'embed_server1': embed_server1,
+        'embed_server2': embed_server2,
+        'title': escape(title),
+        'description': escape(description or ''),
+        'keywords': escape(','.join(labels or [])),
+    }
+
+def fill_episode_skeleton(parts: List[str], values: Dict[str, str]) -> str:
+    out = list(parts)
+    out[1::2] = [values[name] for name in parts[1::2]]
+    return ''.join(out)
+
+# ---------------------------
+# Publishing helpers (unchanged)
+# ---------------------------
+def publish_to_targets(record: Dict[str, Any], rel_path: str, final_title: str, description: str, labels: List[str], render,
+                       journal: Optional[Dict[str, Any]] = None, flush: bool = False) -> Optional[str]:
+    """
+    Write one page to every target that doesn't have it yet and queue a published row per written copy.
+    - render(target) returns the full page HTML. It runs inside the target (see for_each_target), so
+      template, assets, posters and links are the target's; targets render and write in parallel.
+    - The journal checkpoint is only recorded once every target has the page, so a failed copy is retried.
+    - Returns the primary's url (else the first written copy's), or None when nothing could be written.
+    """
+    done = published_targets(record['imdb_id'], record.get('season'), record.get('episode'))
+    todo = [t for t in TARGETS if _target_key(t) not in done]
+    if not todo:
+        return _page_url(rel_path, TARGETS[0])
+
+    def write(target: SiteTarget):
+        with _stage('render'):
+            full_html = render(target)
+        return create_post_and_patch(None, '', Path(rel_path).stem, final_title, '', labels, description, full_html=full_html, rel_path=rel_path)
+
+    results = for_each_target(todo, write)
+    written = [(t, results[t.name]) for t in todo if results.get(t.name) and results[t.name][1]]
+    if len(written) < len(todo):
+        logging.error('%s S%sE%s was not written to target(s) %s', record['imdb_id'], record.get('season'), record.get('episode'),
+                      ', '.join(t.name for t in todo if t not in [w for w, _ in written]))
+    for i, (t, (post_id, post_url)) in enumerate(written):
+        last = i == len(written) - 1
+        record_published(dict(record, target=_target_key(t) or None, blog_post_id=post_id, url=post_url, labels=labels),
+                         journal=journal if last and len(written) == len(todo) else None, flush=flush and last)
+    urls = {t.name: url for t, (_, url) in written}
+    return urls.get(TARGETS[0].name) or next(iter(urls.values()), None)
+
+def publish_pages_to_targets(pages: List[Dict[str, Any]]) -> int:
+    """
+    Batch form of publish_to_targets for bulk work (series backfills, re-renders). pages holds
+    {'record', 'rel_path', 'labels', 'render', 'journal'} dicts, as for publish_to_targets. Every target
+    renders the pages it is missing and writes them as one PageBatch (one group fsync, one git push);
+    rows are queued afterwards in page order, so bookkeeping never gets ahead of the disk.
+    Returns the number of pages now present on every target.
+    """
+    global PUBLISHED_THIS_CYCLE
+    todo: Dict[str, set] = {}
+    for i, page in enumerate(pages):
+        record = page['record']
+        done = published_targets(record['imdb_id'], record.get('season'), record.get('episode'))
+        for t in TARGETS:
+            if _target_key(t) not in done:
+                todo.setdefault(t.name, set()).add(i)
+
+    def write(target: SiteTarget):
+        batch = PageBatch(target.site_dir)
+        for i in sorted(todo[target.name]):
+            page = pages[i]
+            with _stage('render'):
+                batch.add(page['rel_path'], page['render'](target).encode('utf-8'))
+        n = len(batch)
+        changed = batch.commit()
+        if n == 1:
+            rel_path = pages[next(iter(todo[target.name]))]['rel_path']
+            message = f"Add post {Path(rel_path).stem} ({Path(rel_path).parent.as_posix()}) by {AUTHOR_NAME}"
+        else:
+            message = f"Add {n} posts by {AUTHOR_NAME}"
+        ok = _git_commit_and_push(target.site_dir, message, target.git_remote)
+        logging.info('Wrote %s pages (%s changed) to %s (git_push=%s)', n, changed, target.name, ok)
+        return True
+
+    results = for_each_target([t for t in TARGETS if t.name in todo], write)
+    complete = 0
+    for i, page in enumerate(pages):
+        wanted = [t for t in TARGETS if i in todo.get(t.name, ())]
+        written = [t for t in wanted if results.get(t.name)]
+        if len(written) < len(wanted):
+            logging.error('%s S%sE%s was not written to target(s) %s', page['record']['imdb_id'], page['record'].get('season'), page['record'].get('episode'),
+                          ', '.join(t.name for t in wanted if t not in written))
+        else:
+            complete += 1
+        for j, t in enumerate(written):
+            last = j == len(written) - 1
+            if t is TARGETS[0]:
+                PUBLISHED_THIS_CYCLE += 1
+            record_published(dict(page['record'], target=_target_key(t) or None, blog_post_id=Path(page['rel_path']).stem,
+                                  url=_page_url(page['rel_path'], t), labels=page['labels']),
+                             journal=page.get('journal') if last and len(written) == len(wanted) else None)
+    return complete
+
+def publish_missing_episodes(title: TitleRecord, service=None, only_seasons: Optional[Iterable[int]] = None,
+                             series: Optional[Dict[int, Tuple[List[int], List[Tuple[int, Optional[str]]]]]] = None,
+                             batch_size: Optional[int] = None):
+    # batch_size: episodes per group commit and publish sleep (default: 1, or WRITE_BATCH_SIZE with BATCH_LIVE_EPISODES)
+    imdb_id, tmdb_id, name_use, year = title.imdb_id, title.tmdb_id, title.name, title.year
+    seasons_list = title.seasons_list
+    logging.info('Publishing missing episodes for %s', imdb_id)
+    only = set(only_seasons) if only_seasons is not None else None
+    if series is None:
+        series = load_series_metadata(tmdb_id, seasons_list)
+    links = episode_links(name_use, series, imdb_id)
+    link_paths = {(sn, ep): rel for sn, eps in links for ep, rel in eps}
+    schema_prefix = title.schema_prefix
+    # everything except the embed URLs, title, description and keywords is the same for every
+    # episode of the series, so it is computed (and, with SKELETON_RENDER, rendered) once per target
+    prepared: Dict[str, Dict[str, Any]] = {}
+
+    def render(target: SiteTarget, embed_server1: str, embed_server2: str, final_title: str, description: str, labels: List[str]) -> str:
+        st = prepared.get(target.name)
+        if st is None:
+            context_base = title.context(episodes_html=build_episodes_html(name_use, year, seasons_list, links=links))
+            st = prepared[target.name] = {'context': context_base, 'verified': False,
+                                          'skeleton': build_episode_skeleton(context_base, schema_prefix) if SKELETON_RENDER else None}
+        if st['skeleton'] is not None:
+            full_html = fill_episode_skeleton(st['skeleton'], episode_slot_values(embed_server1, embed_server2, final_title, description, labels))
+            if st['verified']:
+                return full_html
+            # byte-for-byte check of the first page against the full renderer
+            reference = render_episode_page(st['context'], schema_prefix, embed_server1, embed_server2, final_title, description, labels)
+            st['verified'] = True
+            if full_html == reference:
+                return full_html
+            logging.warning('Skeleton render of %s differs from the full renderer (target %s); rendering this series page by page.', imdb_id, target.name)
+            st['skeleton'] = None
+            return reference
+        return render_episode_page(st['context'], schema_prefix, embed_server1, embed_server2, final_title, description, labels)
+
+    pending: List[Dict[str, Any]] = []
+
+    if batch_size is None:
+        batch_size = WRITE_BATCH_SIZE if BATCH_LIVE_EPISODES else 1
+
+    def publish_pending():
+        # one batch per batch_size episodes: one group commit and git push per target, one publish sleep
+        try:
+            published = publish_pages_to_targets(pending)
+            logging.info('Published %s of %s episodes of %s (through S%sE%s)', published, len(pending), imdb_id,
+                         pending[-1]['record']['season'], pending[-1]['record']['episode'])
+            if published:
+                random_sleep_after_publish()
+        except Exception:
+            logging.exception('Failed to publish a batch of %s episodes of %s', len(pending), imdb_id)
+        pending.clear()
+
+    for sn, (aired, upcoming) in series.items():
+        if only is not None and sn not in only:
+            continue
+        logging.info('Season %s has %s aired / %s upcoming episodes (imdb=%s)', sn, len(aired), len(upcoming), imdb_id)
+        if tmdb_id:
+            schedule_episodes(imdb_id, tmdb_id, sn, upcoming)
+        for ep in aired:
+            # db_has makes a resumed run idempotent; episodes that failed before the journal checkpoint are retried too
+            if db_has(imdb_id, sn, ep):
+                continue
+            embed_server1 = f'https://vidsrc.xyz/embed/tv/{imdb_id}/{sn}/{ep}'
+            embed_server2 = f'https://vidsrc.to/embed/tv/{imdb_id}/{sn}/{ep}'
+            # episode_links already reserved every aired episode
+            rel_path = link_paths.get((sn, ep)) or url_reserve(imdb_id, sn, ep, f"{slugify(name_use)}-{sn}-{ep}")['rel_path']
+            final_title = f"مشاهده مسلسل {name_use} الموسم {sn} الحلقه {ep} مترجم - ايجی بست"
+            description = f"مشاهده و تنزيل مسلسل {name_use} الموسم {sn} الحلقه {ep}"
+            labels = title.page_labels()
+            pending.append({
+                'record': {'imdb_id': imdb_id, 'content_type': 'tv', 'name': name_use, 'year': year, 'season': sn, 'episode': ep},
+                'rel_path': rel_path,
+                'labels': labels,
+                'render': (lambda t, e1=embed_server1, e2=embed_server2, ft=final_title, d=description, lb=labels: render(t, e1, e2, ft, d, lb)),
+                'journal': {'last_season': sn, 'last_episode': ep},
+            })
+            if len(pending) >= batch_size:
+                publish_pending()
+    if pending:
+        publish_pending()
+
+def publish_imdb_item(imdb_id: str, season: Optional[int] = None, episode: Optional[int] = None, is_dry_run: bool = False):
+    logging.info('Processing %s (s=%s e=%s)', imdb_id, season, episode)
+    if is_dry_run and not DRY_RUN:
+        # the shadow paths are bound at import time; a per-call flag cannot redirect them safely
+        logging.error('is_dry_run requires DRY_RUN=1 in the environment; refusing to publish %s for real.', imdb_id)
+        return None
+    journal = journal_get(imdb_id) if season is None and episode is None else None
+    if journal is None and season is None and episode is None and db_has(imdb_id, None, None):
+        logging.info('Already published (movie or tv root). Fast skip.')
+        return None
+    if journal:
+        # interrupted series: reuse the resolved ids and metadata snapshot instead of refetching
+        title = journal_title(journal)
+        logging.info('Resuming %s from journal (stage=%s, last=S%sE%s)', imdb_id, journal.get('stage'), journal.get('last_season'), journal.get('last_episode'))
+    else:
+        title = fetch_title(imdb_id)
+        if title is None:
+            return None
+        if title.is_tv and season is None and episode is None:
+            journal_begin(title)
+    kind, tmdb_id, name_use, year, is_tv = title.kind, title.tmdb_id, title.name, title.year, title.is_tv
     root_slug = slugify(f"{name_use}{year}") if name_use else slugify(imdb_id)
-    seasons_list = data_ar.get('seasons') or data_en.get('seasons') or []
+    seasons_list = title.seasons_list
     logging.info('Seasons from TMDB for %s: %s', imdb_id, seasons_list)
     embed_server_movie_1 = f'https://vidsrc.xyz/embed/movie/{imdb_id}'
     embed_server_movie_2 = f'https://vidsrc.to/embed/movie/{imdb_id}'
-    context_base = {
-        'image_url': 'https://image.tmdb.org/t/p/w780' + (poster_path or ''),
-        'name': name_use,
-        'year': year,
-        'content_type': 'مسلسل' if is_tv else 'فيلم',
-        'country': (data_ar.get('production_countries') or [{}])[0].get('name', ''),
-        'lang': data_en.get('original_language', ''),
-        'category': ', '.join([g.get('name') for g in (data_ar.get('genres') or [])]),
-        'imdb_rating': data_en.get('vote_average') or data_ar.get('vote_average') or '',
-        'release_date': data_ar.get('release_date') or data_ar.get('first_air_date') or '',
-        'show_time': data_ar.get('runtime') or (data_ar.get('episode_run_time')[0] if data_ar.get('episode_run_time') else ''),
-        'story': data_ar.get('overview') or data_en.get('overview') or '',
-        'embed_server1': embed_server_movie_1,
-        'embed_server2': embed_server_movie_2,
-        'episodes_html': build_episodes_html(name_use, year, seasons_list, tmdb_id, date_prefix=''),
-        'search_spans': build_search_spans(name_use, year, is_tv)
-    }
-    try:
-        schema_root = build_jsonld_schema(kind, data_en or data_ar, imdb_id, season, episode)
-    except Exception:
-        schema_root = None
+    # TMDB lookups and url reservations happen once here; only rendering is repeated per target
+    series = load_series_metadata(tmdb_id, seasons_list) if is_tv else {}
+    links = episode_links(name_use, series, imdb_id)
+
+    def render_page(target: SiteTarget, final_title: str, description: str, labels: List[str], **embeds) -> str:
+        context = title.context(embed_server1=embed_server_movie_1, embed_server2=embed_server_movie_2,
+                                episodes_html=build_episodes_html(name_use, year, seasons_list, links=links))
+        context.update(embeds)
+        return _render_full_html(final_title, description, title.schema_prefix + _page_template().render(**context), labels=labels)
 
     # TV root
     if is_tv and season is None and episode is None:
-        if db_has(imdb_id, None, None):
-            logging.info('Series root exists (second check). Publishing missing episodes only.')
-            conn = sqlite3.connect(DB_PATH)
-            try:
-                cur = conn.cursor()
-                cur.execute('SELECT url FROM published WHERE imdb_id=? AND season IS NULL AND episode IS NULL', (imdb_id,))
-                row = cur.fetchone()
-                root_date_prefix = ''
-                if row and row[0]:
-                    parsed = urlparse(row[0])
-                    parts = parsed.path.split('/')
-                    if len(parts) >= 3 and parts[1].isdigit() and parts[2].isdigit():
-                        root_date_prefix = f"/{parts[1]}/{parts[2]}"
-            finally:
-                conn.close()
-            publish_missing_episodes(imdb_id, tmdb_id, name_use, year, seasons_list, data_ar, data_en, root_date_prefix, None)
-            return True
-        temp_title = root_slug
         final_title = f"مشاهده مسلسل {name_use} {year} مترجم - ايجی بست"
         description = f"مشاهده و تنزيل مسلسل {name_use} {year} مترجم اونلاين - ايجی بست"
-        html_content = Template(HTML_TEMPLATE).render(**context_base)
-        content_with_schema = (f"<script type='application/ld+json'>{json.dumps(schema_root, ensure_ascii=False)}</script>\n" if schema_root else "") + html_content
-        labels = generate_labels('tv', data_ar or data_en, None, None)
-        labels = [l for l in labels if isinstance(l, str) and l.strip()]
-        ordered = []
-        if 'en' in labels:
-            ordered.append('en'); labels.remove('en')
-        base = 'series'
-        if base in labels:
-            ordered.append(base); labels.remove(base)
-        ordered.extend(labels)
-        ordered.append(random.choice(['hd', 'hdtv']))
-        labels = ordered
-        try:
-            post_id, post_url = create_post_and_patch(None, '', temp_title, final_title, content_with_schema, labels, description)
-            db_insert({
-                'imdb_id': imdb_id,
-                'content_type': 'tv',
-                'name': name_use,
-                'year': year,
-                'season': None,
-                'episode': None,
-                'blog_post_id': post_id,
-                'url': post_url
-            })
-            mark_imdb_published(imdb_id)
+        labels = title.page_labels()
+        root_loc = url_reserve(imdb_id, None, None, root_slug)
+        relink_root = False
+        if db_has(imdb_id, None, None):
+            logging.info('Series root exists (second check). Publishing missing episodes only.')
+            # a journal that never reached root_linked means we died before the links rewrite
+            relink_root = bool(journal) and journal.get('stage') != 'root_linked'
+        else:
             try:
-                removed = remove_imdb_ids_from_txt([imdb_id], IMDB_FILE)
-                if removed:
-                    logging.info('Removed %s from file after root publish (removed=%s)', imdb_id, removed)
+                # flushed right away: the journal resume path reads the root row back. Episode links
+                # point at url_index reservations, so the root is final as written.
+                post_url = publish_to_targets(
+                    {'imdb_id': imdb_id, 'content_type': 'tv', 'name': name_use, 'year': year, 'season': None, 'episode': None},
+                    root_loc['rel_path'], final_title, description, labels,
+                    lambda t: render_page(t, final_title, description, labels),
+                    journal={'stage': 'root_linked'}, flush=True)
             except Exception:
-                logging.exception('Failed to remove imdb id from file after root publish %s', imdb_id)
+                logging.exception('Failed to create series root for %s', imdb_id)
+                return None
+            if post_url is None:
+                logging.error('Failed to create series root for %s', imdb_id)
+                return None
             logging.info('Published series root: %s -> %s', final_title, post_url)
-            parsed = urlparse(post_url)
-            date_prefix = ''
-            try:
-                parts = parsed.path.split('/')
-                if len(parts) >= 3 and parts[1].isdigit() and parts[2].isdigit():
-                    date_prefix = f"/{parts[1]}/{parts[2]}"
-            except Exception:
-                date_prefix = ''
-            context_base['episodes_html'] = build_episodes_html(name_use, year, seasons_list, tmdb_id, date_prefix=date_prefix)
-            updated_content = Template(HTML_TEMPLATE).render(**context_base)
-            updated_with_schema = (f"<script type='application/ld+json'>{json.dumps(schema_root, ensure_ascii=False)}</script>\n" if schema_root else "") + updated_content
-            # For static site, write updated root post file again (replace)
-            try:
-                # use temp_title (slug) to write again
-                create_post_and_patch(None, '', temp_title, final_title, updated_with_schema, labels, description)
-                logging.info('Updated series root with dated links: %s', post_url)
-            except Exception as e:
-                logging.exception('Failed to update root post with dated links: %s', e)
-            publish_missing_episodes(imdb_id, tmdb_id, name_use, year, seasons_list, data_ar, data_en, date_prefix, None)
-            return True
-        except Exception:
-            logging.exception('Failed to create series root for %s', imdb_id)
-            return None
+        if relink_root:
+            # journals from before url_index: the root still carries undated episode links
+            def relink(target: SiteTarget):
+                with _stage('render'):
+                    full_html = render_page(target, final_title, description, labels)
+                return create_post_and_patch(None, '', root_slug, final_title, '', labels, description, full_html=full_html, rel_path=root_loc['rel_path'])
+            results = for_each_target(TARGETS, relink)
+            if all(r and r[1] for r in results.values()):
+                journal_update(imdb_id, stage='root_linked')
+                logging.info('Updated series root with indexed links on %s target(s)', len(results))
+            else:
+                logging.error('Failed to update root post of %s with indexed links', imdb_id)
+        publish_missing_episodes(title, None, series=series)
+        save_series_state(imdb_id, tmdb_id, seasons_list)
+        # the journal may only go once every checkpointed episode row is committed
+        flush_bookkeeping()
+        journal_clear(imdb_id)
+        return True
 
     # Movie root
     if kind == 'movie' and season is None and episode is None:
-        temp_title = root_slug
         final_title = f"مشاهده فیلم {name_use} {year} مترجم - ايجی بست"
         description = f"مشاهده وتنزيل فیلم {name_use} {year} مترجم اونلاين - ايجی بست"
-        html_content = Template(HTML_TEMPLATE).render(**context_base)
-        content_with_schema = (f"<script type='application/ld+json'>{json.dumps(schema_root, ensure_ascii=False)}</script>\n" if schema_root else "") + html_content
-        labels = generate_labels('movie', data_ar or data_en, None, None)
-        labels = [l for l in labels if isinstance(l, str) and l.strip()]
-        ordered = []
-        if 'en' in labels:
-            ordered.append('en'); labels.remove('en')
-        base = 'movies'
-        if base in labels:
-            ordered.append(base); labels.remove(base)
-        ordered.extend(labels)
-        ordered.append(random.choice(['hd', 'hdtv']))
-        labels = ordered
+        labels = title.page_labels()
         try:
-            post_id, post_url = create_post_and_patch(None, '', temp_title, final_title, content_with_schema, labels, description)
-            db_insert({
-                'imdb_id': imdb_id,
-                'content_type': 'movie',
-                'name': name_use,
-                'year': year,
-                'season': None,
-                'episode': None,
-                'blog_post_id': post_id,
-                'url': post_url
-            })
-            mark_imdb_published(imdb_id)
-            try:
-                removed = remove_imdb_ids_from_txt([imdb_id], IMDB_FILE)
-                if removed:
-                    logging.info('Removed %s from file after movie publish (removed=%s)', imdb_id, removed)
-            except Exception:
-                logging.exception('Failed to remove imdb id from file after movie publish %s', imdb_id)
+            movie_loc = url_reserve(imdb_id, None, None, root_slug)
+            post_url = publish_to_targets(
+                {'imdb_id': imdb_id, 'content_type': 'movie', 'name': name_use, 'year': year, 'season': None, 'episode': None},
+                movie_loc['rel_path'], final_title, description, labels,
+                lambda t: render_page(t, final_title, description, labels))
+            if post_url is None:
+                return None
             logging.info('Published movie: %s -> %s', final_title, post_url)
             random_sleep_after_publish()
             return True
@@ -970,73 +2837,31 @@ def publish_imdb_item(imdb_id: str, season: Optional[int] = None, episode: Optio
     if is_tv and season is not None and episode is not None:
         if db_has(imdb_id, season, episode):
             logging.info('Episode already published. Skipping S%sE%s', season, episode)
-            try:
-                removed = remove_imdb_ids_from_txt([imdb_id], IMDB_FILE)
-                if removed:
-                    logging.info('Removed %s from file because episode already published (removed=%s)', imdb_id, removed)
-            except Exception:
-                logging.exception('Failed to remove imdb id from file after skip %s', imdb_id)
+            queue_remove(imdb_id)
+            return None
+        if season in series:
+            aired, upcoming = series[season]
+        else:
+            season_meta = next((s for s in seasons_list if s.get('season_number') == season), {'season_number': season})
+            aired, upcoming = season_aired_episodes(tmdb_id, season_meta)
+        if episode not in aired:
+            logging.info('S%sE%s of %s has not aired yet; scheduling instead of publishing.', season, episode, imdb_id)
+            schedule_episodes(imdb_id, tmdb_id, season, [u for u in upcoming if u[0] == episode] or [(episode, None)])
             return None
         embed_server1 = f'https://vidsrc.xyz/embed/tv/{imdb_id}/{season}/{episode}'
         embed_server2 = f'https://vidsrc.to/embed/tv/{imdb_id}/{season}/{episode}'
-        episodes_html = build_episodes_html(name_use, year, seasons_list, tmdb_id, date_prefix='')
-        context = {
-            'image_url': 'https://image.tmdb.org/t/p/w780' + (poster_path or ''),
-            'name': name_use,
-            'year': year,
-            'content_type': 'مسلسل',
-            'country': (data_ar.get('production_countries') or [{}])[0].get('name', ''),
-            'lang': data_en.get('original_language', ''),
-            'category': ', '.join([g.get('name') for g in (data_ar.get('genres') or [])]),
-            'imdb_rating': data_en.get('vote_average') or data_ar.get('vote_average') or '',
-            'release_date': data_ar.get('release_date') or data_ar.get('first_air_date') or '',
-            'show_time': data_ar.get('runtime') or (data_ar.get('episode_run_time')[0] if data_ar.get('episode_run_time') else ''),
-            'story': data_ar.get('overview') or data_en.get('overview') or '',
-            'embed_server1': embed_server1,
-            'embed_server2': embed_server2,
-            'episodes_html': episodes_html,
-            'search_spans': build_search_spans(name_use, year, True)
-        }
-        html_content = Template(HTML_TEMPLATE).render(**context)
-        try:
-            schema = build_jsonld_schema('tv', data_en or data_ar, imdb_id, season, episode)
-        except Exception:
-            schema = None
-        content_with_schema = (f"<script type='application/ld+json'>{json.dumps(schema, ensure_ascii=False)}</script>\n" if schema else "") + html_content
         ep_slug = f"{slugify(name_use)}-{season}-{episode}"
-        temp_title = ep_slug
         final_title = f"مشاهده مسلسل {name_use} الموسم {season} الحلقه {episode} {year} مترجم - ایجی بست"
         description = f"مشاهده و تنزيل مسلسل {name_use} الموسم {season} الحلقه {episode}"
-        labels = generate_labels('tv', data_ar or data_en, season, episode)
-        labels = [l for l in labels if isinstance(l, str) and l.strip()]
-        ordered = []
-        if 'en' in labels:
-            ordered.append('en'); labels.remove('en')
-        base = 'series'
-        if base in labels:
-            ordered.append(base); labels.remove(base)
-        ordered.extend(labels)
-        ordered.append(random.choice(['hd', 'hdtv']))
-        labels = ordered
+        labels = title.page_labels()
         try:
-            post_id, post_url = create_post_and_patch(None, '', temp_title, final_title, content_with_schema, labels, description)
-            db_insert({
-                'imdb_id': imdb_id,
-                'content_type': 'tv',
-                'name': name_use,
-                'year': year,
-                'season': season,
-                'episode': episode,
-                'blog_post_id': post_id,
-                'url': post_url
-            })
-            mark_imdb_published(imdb_id)
-            try:
-                removed = remove_imdb_ids_from_txt([imdb_id], IMDB_FILE)
-                if removed:
-                    logging.info('Removed %s from file after episode publish (removed=%s)', imdb_id, removed)
-            except Exception:
-                logging.exception('Failed to remove imdb id from file after episode publish %s', imdb_id)
+            ep_loc = url_reserve(imdb_id, season, episode, ep_slug)
+            post_url = publish_to_targets(
+                {'imdb_id': imdb_id, 'content_type': 'tv', 'name': name_use, 'year': year, 'season': season, 'episode': episode},
+                ep_loc['rel_path'], final_title, description, labels,
+                lambda t: render_page(t, final_title, description, labels, embed_server1=embed_server1, embed_server2=embed_server2))
+            if post_url is None:
+                return None
             logging.info('Published episode: %s -> %s', final_title, post_url)
             random_sleep_after_publish()
             return True
@@ -1046,12 +2871,853 @@ def publish_imdb_item(imdb_id: str, season: Optional[int] = None, episode: Optio
 
     return None
 
+# ---------------------------
+# Ongoing series refresh (TMDB /tv/changes feed)
+# ---------------------------
+def _load_progress(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f) or {}
+    except (OSError, ValueError):
+        return {}
+
+def _save_progress(path: str, data: Dict[str, Any]):
+    target_dir = os.path.dirname(os.path.abspath(path)) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='progress_tmp_', dir=target_dir, text=True)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def tmdb_tv_changes(start: date, end: date) -> Optional[List[int]]:
+    """All TMDB tv ids changed in [start, end] (max 14 days). None on failure so the cursor is not advanced."""
+    ids: List[int] = []
+    page, total_pages = 1, 1
+    while page <= total_pages:
+        params = {'start_date': start.isoformat(), 'end_date': end.isoformat(), 'page': page}
+        try:
+            r = tmdb_get('/tv/changes', params)
+        except Exception:
+            logging.exception('TMDB tv/changes request failed (%s..%s page %s)', start, end, page)
+            return None
+        if r.status_code != 200:
+            logging.error('TMDB tv/changes failed: %s %s', r.status_code, r.text)
+            return None
+        body = r.json() or {}
+        ids.extend(int(x['id']) for x in body.get('results') or [] if x.get('id') and not x.get('adult'))
+        total_pages = int(body.get('total_pages') or 1)
+        page += 1
+    return ids
+
+def _backfill_series_state(limit: int = 50):
+    """Series published before series_state existed: resolve their tmdb id (imdb_queue first, then /find)."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cur = conn.cursor()
+        cur.execute('''SELECT p.imdb_id FROM published p LEFT JOIN series_state s ON s.imdb_id = p.imdb_id
+                       WHERE p.content_type='tv' AND p.season IS NULL AND p.episode IS NULL AND s.imdb_id IS NULL LIMIT ?''', (limit,))
+        missing = [r[0] for r in cur.fetchall()]
+    finally:
+        conn.close()
+    for imdb_id in missing:
+        tmdb_id = None
+        if os.path.exists(IMDB_DB_PATH):
+            try:
+                qconn = sqlite3.connect(IMDB_DB_PATH)
+                try:
+                    row = qconn.execute("SELECT tmdb_id FROM imdb_queue WHERE imdb_id=? AND type='tv'", (imdb_id,)).fetchone()
+                finally:
+                    qconn.close()
+                tmdb_id = row[0] if row else None
+            except Exception:
+                tmdb_id = None
+        if not tmdb_id:
+            found = tmdb_find_by_imdb(imdb_id) or {}
+            tv = found.get('tv_results') or []
+            tmdb_id = tv[0].get('id') if tv else None
+        if tmdb_id:
+            # empty snapshot -> every season counts as changed on the next feed hit
+            save_series_state(imdb_id, tmdb_id, [])
+
+def refresh_series(imdb_id: str, tmdb_id: int, known_counts: Dict[str, int], force_seasons: Iterable[int] = ()) -> int:
+    """Refetch one published series and publish missing episodes of the seasons whose episode count changed (plus force_seasons)."""
+    data_ar = tmdb_get_detail('tv', tmdb_id, lang='ar') or {}
+    data_en = tmdb_get_detail('tv', tmdb_id, lang='en') or {}
+    if not data_ar and not data_en:
+        return 0
+    title = TitleRecord.from_tmdb(imdb_id, 'tv', tmdb_id, data_ar, data_en)
+    del data_ar, data_en
+    seasons_list = title.seasons_list
+    counts = _season_counts(seasons_list)
+    changed = sorted({int(sn) for sn, n in counts.items() if known_counts.get(sn) != n or n == 0} | set(force_seasons))
+    if changed:
+        logging.info('Refreshing %s (tmdb=%s): changed seasons %s', imdb_id, tmdb_id, changed)
+        publish_missing_episodes(title, None, only_seasons=changed)
+    save_series_state(imdb_id, tmdb_id, seasons_list)
+    return len(changed)
+
+def refresh_ongoing_series(progress_path: str = TV_CHANGES_PROGRESS_FILE) -> int:
+    """
+    Walk the TMDB tv change feed from the persisted cursor_end up to today, in 14-day windows,
+    and refresh only the published series that appear in it. Returns the number of series refreshed.
+    """
+    today = datetime.now(timezone.utc).date()
+    progress = _load_progress(progress_path)
+    try:
+        cursor = date.fromisoformat(progress.get('cursor_end') or '')
+    except ValueError:
+        # first run: nothing to catch up on, just start following the feed from today
+        _save_progress(progress_path, {'cursor_end': today.isoformat()})
+        return 0
+    if cursor >= today:
+        return 0
+    _backfill_series_state()
+    # collect the whole catch-up range first so a series changed in several windows is refreshed once
+    changed_ids: set = set()
+    window_start = cursor
+    while window_start < today:
+        window_end = min(window_start + timedelta(days=TV_CHANGES_MAX_WINDOW_DAYS), today)
+        window_ids = tmdb_tv_changes(window_start, window_end)
+        if window_ids is None:
+            break
+        changed_ids.update(window_ids)
+        window_start = window_end
+    if window_start == cursor:
+        return 0
+    tracked: Dict[int, Any] = {}
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cur = conn.cursor()
+        ids = sorted(changed_ids)
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i+500]
+            cur.execute(f"SELECT tmdb_id, imdb_id, seasons FROM series_state WHERE tmdb_id IN ({','.join('?' * len(batch))})", batch)
+            for tmdb_id, imdb_id, seasons in cur.fetchall():
+                tracked[tmdb_id] = (imdb_id, json.loads(seasons or '{}'))
+    finally:
+        conn.close()
+    logging.info('TMDB tv changes %s..%s: %s changed, %s published by us', cursor, window_start, len(changed_ids), len(tracked))
+    refreshed = 0
+    for tmdb_id, (imdb_id, known) in tracked.items():
+        try:
+            if refresh_series(imdb_id, tmdb_id, known):
+                refreshed += 1
+        except Exception:
+            logging.exception('Failed to refresh series %s (tmdb=%s)', imdb_id, tmdb_id)
+    _save_progress(progress_path, {'cursor_end': window_start.isoformat()})
+    return refreshed
+
+def release_due_episodes() -> int:
+    """
+    Publish scheduled episodes whose air date has arrived. Returns the number of series touched.
+    After the refresh, rows of published episodes and of episodes the season no longer lists (renumbered,
+    removed) are dropped; a row that is still unpublished waits SCHEDULE_RETRY_HOURS (doubling) before the
+    next release and is dropped after SCHEDULE_MAX_ATTEMPTS.
+    """
+    now = datetime.now(timezone.utc)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cur = conn.cursor()
+        cur.execute('''SELECT e.imdb_id, e.tmdb_id, e.season, s.seasons FROM episode_schedule e
+                       LEFT JOIN series_state s ON s.imdb_id = e.imdb_id
+                       WHERE e.air_date IS NOT NULL AND e.air_date <= ? AND IFNULL(e.retry_after, '') <= ?
+                       GROUP BY e.imdb_id, e.season''', (_today_iso(), now.isoformat()))
+        due: Dict[str, Any] = {}
+        for imdb_id, tmdb_id, season, seasons in cur.fetchall():
+            entry = due.setdefault(imdb_id, {'tmdb_id': tmdb_id, 'known': json.loads(seasons or '{}'), 'seasons': set()})
+            entry['seasons'].add(season)
+    finally:
+        conn.close()
+    listed: Dict[Tuple[str, int], set] = {}
+    for imdb_id, entry in due.items():
+        logging.info('Releasing due episodes of %s seasons %s', imdb_id, sorted(entry['seasons']))
+        try:
+            refresh_series(imdb_id, entry['tmdb_id'], entry['known'], force_seasons=entry['seasons'])
+        except Exception:
+            logging.exception('Failed to release due episodes of %s', imdb_id)
+        for sn in entry['seasons']:
+            # served from season_cache, which the refresh just brought up to date
+            episodes = get_season_episodes(entry['tmdb_id'], sn)
+            if episodes is not None:
+                listed[(imdb_id, sn)] = {e['episode_number'] for e in episodes}
+    if due:
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            with conn:
+                conn.execute('''DELETE FROM episode_schedule WHERE EXISTS (
+                                    SELECT 1 FROM published p WHERE p.imdb_id = episode_schedule.imdb_id
+                                    AND p.season = episode_schedule.season AND p.episode = episode_schedule.episode)''')
+                for (imdb_id, sn), episodes in listed.items():
+                    gone = [r[0] for r in conn.execute('SELECT episode FROM episode_schedule WHERE imdb_id=? AND season=?', (imdb_id, sn))
+                            if r[0] not in episodes]
+                    if gone:
+                        logging.info('Dropping schedule of %s S%s episodes %s: no longer listed by TMDB', imdb_id, sn, gone)
+                        conn.executemany('DELETE FROM episode_schedule WHERE imdb_id=? AND season=? AND episode=?', [(imdb_id, sn, ep) for ep in gone])
+                for imdb_id, entry in due.items():
+                    for sn in entry['seasons']:
+                        rows = conn.execute('''SELECT episode, attempts FROM episode_schedule WHERE imdb_id=? AND season=?
+                                               AND air_date IS NOT NULL AND air_date <= ?''', (imdb_id, sn, _today_iso())).fetchall()
+                        for ep, attempts in rows:
+                            if attempts + 1 >= SCHEDULE_MAX_ATTEMPTS:
+                                logging.warning('Giving up on scheduled %s S%sE%s after %s releases', imdb_id, sn, ep, attempts + 1)
+                                conn.execute('DELETE FROM episode_schedule WHERE imdb_id=? AND season=? AND episode=?', (imdb_id, sn, ep))
+                            else:
+                                retry_after = now + timedelta(hours=SCHEDULE_RETRY_HOURS * 2 ** attempts)
+                                conn.execute('UPDATE episode_schedule SET attempts=?, retry_after=? WHERE imdb_id=? AND season=? AND episode=?',
+                                             (attempts + 1, retry_after.isoformat(), imdb_id, sn, ep))
+        finally:
+            conn.close()
+    return len(due)
+
+# ---------------------------
+# Discovery (keeps imdb_queue / IMDB_FILE filled without the external bootstrap crawl)
+# ---------------------------
+IMDB_QUEUE_SCHEMA_SQL = '''
+CREATE TABLE IF NOT EXISTS imdb_queue (
+    imdb_id TEXT PRIMARY KEY,
+    tmdb_id INTEGER,
+    title TEXT,
+    release_date TEXT,
+    popularity REAL,
+    type TEXT,
+    status TEXT,
+    date_added TEXT,
+    published_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_release_date ON imdb_queue(release_date DESC);
+CREATE INDEX IF NOT EXISTS idx_imdb_queue_tmdb ON imdb_queue(tmdb_id, type);
+-- released ids still to be appended to IMDB_FILE: written with their imdb_queue rows, applied after the commit
+CREATE TABLE IF NOT EXISTS file_append_log (
+    imdb_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS meta_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+def tmdb_discover_window(kind: str, start: date, end: date) -> Optional[List[Dict[str, Any]]]:
+    """All titles released in [start, end] from /discover/{kind}. None on failure so the cursor is not advanced."""
+    date_field = 'primary_release_date' if kind == 'movie' else 'first_air_date'
+    items: List[Dict[str, Any]] = []
+    page, total_pages = 1, 1
+    while page <= min(total_pages, DISCOVER_MAX_PAGES):
+        params = {f'{date_field}.gte': start.isoformat(), f'{date_field}.lte': end.isoformat(),
+                  'sort_by': f'{date_field}.asc', 'include_adult': 'false', 'page': page}
+        if DISCOVER_MIN_VOTE_COUNT:
+            params['vote_count.gte'] = DISCOVER_MIN_VOTE_COUNT
+        try:
+            r = tmdb_get(f'/discover/{kind}', params)
+        except Exception:
+            logging.exception('TMDB discover/%s request failed (%s..%s page %s)', kind, start, end, page)
+            return None
+        if r.status_code != 200:
+            logging.error('TMDB discover/%s failed: %s %s', kind, r.status_code, r.text)
+            return None
+        body = r.json() or {}
+        for x in body.get('results') or []:
+            if not x.get('id') or x.get('adult'):
+                continue
+            items.append({
+                'tmdb_id': int(x['id']),
+                'title': x.get('title') or x.get('name') or x.get('original_title') or x.get('original_name') or '',
+                'release_date': x.get('release_date') or x.get('first_air_date') or None,
+                'popularity': x.get('popularity'),
+                'type': kind,
+            })
+        total_pages = int(body.get('total_pages') or 1)
+        page += 1
+    if total_pages > DISCOVER_MAX_PAGES:
+        logging.warning('discover/%s %s..%s has %s pages; only the first %s are reachable (shrink DISCOVER_WINDOW_DAYS).',
+                        kind, start, end, total_pages, DISCOVER_MAX_PAGES)
+    return items
+
+def tmdb_external_imdb_id(kind: str, tmdb_id: int) -> Optional[str]:
+    r = tmdb_get(f'/{kind}/{tmdb_id}/external_ids')
+    if r.status_code != 200:
+        logging.warning('TMDB external_ids %s %s failed: %s', kind, tmdb_id, r.status_code)
+        return None
+    imdb_id = (r.json() or {}).get('imdb_id') or ''
+    return imdb_id if IMDB_REGEX.match(imdb_id) else None
+
+def _discover_upsert(conn: sqlite3.Connection, kind: str, items: List[Dict[str, Any]]) -> List[str]:
+    """
+    Resolve IMDb ids for titles not yet queued and upsert the window in one transaction.
+    Newly queued released ids (not published yet) are logged in file_append_log in that transaction and
+    appended to IMDB_FILE after it commits; a log left by a crash is applied by the next run.
+    Returns the newly queued imdb ids.
+    """
+    by_tmdb = {it['tmdb_id']: it for it in items}
+    known = set()
+    ids = list(by_tmdb)
+    for i in range(0, len(ids), 500):
+        batch = ids[i:i+500]
+        known.update(r[0] for r in conn.execute(
+            f"SELECT tmdb_id FROM imdb_queue WHERE type=? AND tmdb_id IN ({','.join('?' * len(batch))})", [kind] + batch))
+    unknown = [t for t in ids if t not in known]
+    resolved: Dict[int, str] = {}
+    if unknown:
+        with ThreadPoolExecutor(max_workers=max(1, DISCOVER_WORKERS), thread_name_prefix='discover') as pool:
+            for tmdb_id, imdb_id in zip(unknown, pool.map(lambda t: _safe_external_imdb_id(kind, t), unknown)):
+                if imdb_id:
+                    resolved[tmdb_id] = imdb_id
+    already = set()
+    imdb_ids = list(resolved.values())
+    for i in range(0, len(imdb_ids), 500):
+        batch = imdb_ids[i:i+500]
+        already.update(r[0] for r in conn.execute(f"SELECT imdb_id FROM imdb_queue WHERE imdb_id IN ({','.join('?' * len(batch))})", batch))
+    published = set()
+    pconn = sqlite3.connect(DB_PATH)
+    try:
+        for i in range(0, len(imdb_ids), 500):
+            batch = imdb_ids[i:i+500]
+            published.update(r[0] for r in pconn.execute(f"SELECT DISTINCT imdb_id FROM published WHERE imdb_id IN ({','.join('?' * len(batch))})", batch))
+    finally:
+        pconn.close()
+    now = datetime.now(timezone.utc).isoformat()
+    today = _today_iso()
+    new_ids = [imdb_id for imdb_id in resolved.values() if imdb_id not in already]
+    with conn:
+        conn.executemany('''INSERT INTO imdb_queue (imdb_id, tmdb_id, title, release_date, popularity, type, status, date_added)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT(imdb_id) DO UPDATE SET tmdb_id=excluded.tmdb_id, title=excluded.title,
+                                release_date=excluded.release_date, popularity=excluded.popularity, type=excluded.type''',
+                         [(imdb_id, t, by_tmdb[t]['title'], by_tmdb[t]['release_date'], by_tmdb[t]['popularity'], kind,
+                           'released' if is_aired(by_tmdb[t]['release_date'], today) else 'upcoming', now)
+                          for t, imdb_id in resolved.items()])
+        # already queued titles only get their ranking refreshed
+        conn.executemany('UPDATE imdb_queue SET popularity=? WHERE type=? AND tmdb_id=?',
+                         [(by_tmdb[t]['popularity'], kind, t) for t in known])
+        conn.executemany('INSERT OR IGNORE INTO file_append_log (imdb_id) VALUES (?)',
+                         [(imdb_id,) for t, imdb_id in resolved.items()
+                          if imdb_id not in already and imdb_id not in published and is_aired(by_tmdb[t]['release_date'], today)])
+    apply_file_append_log(conn)
+    return new_ids
+
+def apply_file_append_log(conn: sqlite3.Connection) -> int:
+    """Append the logged ids to IMDB_FILE, then drop them from the log (outside any write transaction)."""
+    ids = [r[0] for r in conn.execute('SELECT imdb_id FROM file_append_log ORDER BY rowid')]
+    if not ids:
+        return 0
+    added = append_imdb_ids_to_txt(ids)
+    with conn:
+        conn.executemany('DELETE FROM file_append_log WHERE imdb_id=?', [(i,) for i in ids])
+    return added
+
+def _safe_external_imdb_id(kind: str, tmdb_id: int) -> Optional[str]:
+    try:
+        return tmdb_external_imdb_id(kind, tmdb_id)
+    except Exception:
+        logging.exception('Failed to resolve IMDb id of %s %s', kind, tmdb_id)
+        return None
+
+def discover_new_titles(progress_path: str = DISCOVER_PROGRESS_FILE, force: bool = False) -> int:
+    """
+    Incremental discovery run: walk release-date windows from the persisted cursor_end (minus a small
+    overlap) up to today, queue new titles and append the released ones to IMDB_FILE.
+    Runs at most every DISCOVER_INTERVAL_HOURS unless forced; after a failed TMDB call the next attempt
+    waits DISCOVER_RETRY_MINUTES, doubling per consecutive failure. Returns the number of newly queued ids.
+    """
+    progress = _load_progress(progress_path)
+    now = datetime.now(timezone.utc)
+    if not force:
+        try:
+            if progress.get('last_run') and now - datetime.fromisoformat(progress['last_run']) < timedelta(hours=DISCOVER_INTERVAL_HOURS):
+                return 0
+            if progress.get('retry_after') and now < datetime.fromisoformat(progress['retry_after']):
+                return 0
+        except ValueError:
+            pass
+    today = now.date()
+    conn = sqlite3.connect(IMDB_DB_PATH)
+    try:
+        conn.executescript(IMDB_QUEUE_SCHEMA_SQL)
+        apply_file_append_log(conn)  # left over from a run that crashed after its commit
+        try:
+            cursor = date.fromisoformat(progress.get('cursor_end') or '')
+        except ValueError:
+            # first run: continue from the newest release the bootstrap crawl queued (or the last month)
+            row = conn.execute("SELECT MAX(release_date) FROM imdb_queue WHERE release_date <= ?", (today.isoformat(),)).fetchone()
+            try:
+                cursor = date.fromisoformat(row[0]) if row and row[0] else today - timedelta(days=30)
+            except ValueError:
+                cursor = today - timedelta(days=30)
+        window_start = max(cursor - timedelta(days=DISCOVER_OVERLAP_DAYS), date(1900, 1, 1))
+        added = 0
+        while window_start <= today:
+            window_end = min(window_start + timedelta(days=DISCOVER_WINDOW_DAYS - 1), today)
+            new_ids: List[str] = []
+            for kind in DISCOVER_TYPES:
+                items = tmdb_discover_window(kind, window_start, window_end)
+                if items is None:
+                    failures = int(progress.get('failures') or 0) + 1
+                    backoff = min(DISCOVER_RETRY_MINUTES * 2 ** (failures - 1), DISCOVER_INTERVAL_HOURS * 60)
+                    logging.warning('Discovery failed %s time(s) in a row; next attempt in %.0f minutes.', failures, backoff)
+                    _save_progress(progress_path, dict(progress, failures=failures,
+                                                       retry_after=(now + timedelta(minutes=backoff)).isoformat()))
+                    return added
+                new_ids.extend(_discover_upsert(conn, kind, items))
+            added += len(new_ids)
+            logging.info('Discovery %s..%s: %s new titles queued', window_start, window_end, len(new_ids))
+            progress = {'cursor_end': window_end.isoformat(), 'last_run': progress.get('last_run')}
+            _save_progress(progress_path, progress)
+            window_start = window_end + timedelta(days=1)
+        _save_progress(progress_path, {'cursor_end': today.isoformat(), 'last_run': now.isoformat()})
+        return added
+    finally:
+        conn.close()
+
+# ---------------------------
+# Site check (`python main.py check [--repair]`)
+# ---------------------------
+_HREF_RE = re.compile(r'href="([^"#?]+\.html)"')
+_YEAR_DIR_RE = re.compile(r'\d{4}')
+_MONTH_DIR_RE = re.compile(r'\d{2}')
+
+_SHARD_DIR_RE = re.compile(r'[0-9a-f]{2}')
+
+def _iter_site_pages(site_dir: str) -> Iterable[str]:
+    """Page paths (relative, '/'-separated) under the YYYY/MM[/h2] directories; assets, img and search hold no pages."""
+    for y in os.scandir(site_dir):
+        if not (y.is_dir() and _YEAR_DIR_RE.fullmatch(y.name)):
+            continue
+        for mth in os.scandir(y.path):
+            if not (mth.is_dir() and _MONTH_DIR_RE.fullmatch(mth.name)):
+                continue
+            for e in os.scandir(mth.path):
+                if e.name.endswith('.html') and e.is_file():
+                    yield f"{y.name}/{mth.name}/{e.name}"
+                elif _SHARD_DIR_RE.fullmatch(e.name) and e.is_dir():
+                    for f in os.scandir(e.path):
+                        if f.name.endswith('.html') and f.is_file():
+                            yield f"{y.name}/{mth.name}/{e.name}/{f.name}"
+
+def _expected_pages(db_path: str = DB_PATH, target_key: str = ''):
+    """({rel_path: (imdb_id, season, episode)} of one target's published pages, same for reserved-but-unpublished ones)."""
+    expected: Dict[str, Tuple[str, Optional[int], Optional[int]]] = {}
+    reserved: Dict[str, Tuple[str, Optional[int], Optional[int]]] = {}
+    conn = sqlite3.connect(db_path)
+    try:
+        for imdb_id, sn, ep, url, rel_path in conn.execute('''SELECT p.imdb_id, p.season, p.episode, p.url, u.rel_path FROM published p
+                                                           LEFT JOIN url_index u ON u.imdb_id = p.imdb_id AND IFNULL(u.season, -1) = IFNULL(p.season, -1)
+                                                                                AND IFNULL(u.episode, -1) = IFNULL(p.episode, -1)
+                                                           WHERE IFNULL(p.target, '') = ?''', (target_key,)):
+            if not rel_path:
+                m = _PAGE_PATH_RE.search(urlparse(url or '').path.replace(os.sep, '/'))
+                rel_path = m.group(1) if m else None
+            if rel_path:
+                expected[rel_path] = (imdb_id, sn, ep)
+        for imdb_id, sn, ep, rel_path in conn.execute('SELECT imdb_id, season, episode, rel_path FROM url_index'):
+            if rel_path not in expected:
+                reserved[rel_path] = (imdb_id, sn, ep)
+    finally:
+        conn.close()
+    return expected, reserved
+
+def _check_pages(site_dir: str, rel_paths: List[str], base_path: str, asset_names: List[str], sidecar_formats: List[str]):
+    """Process-pool worker: [(rel_path, [stale reasons], [linked rel_paths])] for one batch of pages."""
+    decompressors = {'gz': gzip.decompress, 'br': brotli.decompress if brotli is not None else None}
+    asset_re = re.compile(re.escape(f"{base_path}/{ASSETS_SUBDIR}/") + r'(site\.[0-9a-f]{12}\.(?:css|js))')
+    out = []
+    for rel in rel_paths:
+        path = os.path.join(site_dir, rel)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            out.append((rel, ['unreadable'], []))
+            continue
+        reasons = []
+        for ext, decompress in decompressors.items():
+            side = f"{path}.{ext}"
+            if not os.path.exists(side):
+                if ext in sidecar_formats:
+                    reasons.append(f'missing .{ext} sidecar')
+                continue
+            if decompress is None:
+                continue
+            try:
+                with open(side, 'rb') as f:
+                    fresh = decompress(f.read()) == data
+            except Exception:
+                fresh = False
+            if not fresh:
+                reasons.append(f'stale .{ext} sidecar')
+        text = data.decode('utf-8', 'replace')
+        if asset_names:
+            for name in set(asset_re.findall(text)) - set(asset_names):
+                reasons.append(f'old asset {name}')
+        links = []
+        for href in _HREF_RE.findall(text):
+            if '://' in href or href.startswith('//'):
+                continue
+            if base_path and href.startswith(base_path + '/'):
+                href = href[len(base_path):]
+            if href.startswith('/'):
+                links.append(href[1:])
+        out.append((rel, reasons, links))
+    return out
+
+def queue_rerender(items: Iterable[Tuple[str, Optional[int], Optional[int], str]]) -> int:
+    now = datetime.now(timezone.utc).isoformat()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        with conn:
+            cur = conn.executemany('INSERT OR IGNORE INTO rerender_queue (imdb_id, season, episode, reason, queued_at) VALUES (?, ?, ?, ?, ?)',
+                                   [(imdb_id, sn, ep, reason, now) for imdb_id, sn, ep, reason in items])
+        return cur.rowcount
+    finally:
+        conn.close()
+
+def run_check(repair: bool = False) -> int:
+    """
+    Verify every target's site dir against its published rows: missing, orphaned, stale (sidecar
+    mismatch, old asset hash) and broken-link pages. The DB is read in a thread while the tree is walked
+    and pages are hashed/parsed in a process pool. Exit code: 0 clean, 1 problems found, 2 check failed.
+    With repair, missing/stale/broken pages are queued in rerender_queue (orphans are only reported).
+    With several targets, reported paths are prefixed with '<target>:'.
+    """
+    init_db()
+    for target in TARGETS:
+        recover_page_batches(target.site_dir)
+    results = [_check_target(t, repair, f'{t.name}:' if len(TARGETS) > 1 else '') for t in TARGETS]
+    return max(results)
+
+def _check_mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def _check_target(target: SiteTarget, repair: bool, prefix: str) -> int:
+    site_dir = target.site_dir
+    if not os.path.isdir(site_dir):
+        logging.error('Site dir %s of target %s does not exist', site_dir, target.name)
+        return 2
+    started = time.monotonic()
+    base_path = _site_base_path(target)
+    asset_names = [name for name, _ in shared_asset_files().values()] if SHARED_ASSETS else []
+    on_disk = set()
+    stale: List[Tuple[str, List[str]]] = []
+    links: List[Tuple[str, str]] = []
+    try:
+        # forkserver: workers are not forked from this process while the DB reader thread runs (a fork can inherit held locks)
+        with ThreadPoolExecutor(max_workers=1) as db_pool, \
+                ProcessPoolExecutor(max_workers=max(1, CHECK_WORKERS), mp_context=_check_mp_context()) as pool:
+            expected_future = db_pool.submit(_expected_pages, DB_PATH, _target_key(target))
+            futures = []
+            batch: List[str] = []
+            for rel in _iter_site_pages(site_dir):
+                on_disk.add(rel)
+                batch.append(rel)
+                if len(batch) >= CHECK_BATCH:
+                    futures.append(pool.submit(_check_pages, site_dir, batch, base_path, asset_names, _precompress_formats()))
+                    batch = []
+            if batch:
+                futures.append(pool.submit(_check_pages, site_dir, batch, base_path, asset_names, _precompress_formats()))
+            for fut in futures:
+                for rel, reasons, page_links in fut.result():
+                    if reasons:
+                        stale.append((rel, reasons))
+                    links.extend((rel, link) for link in page_links)
+            expected, reserved = expected_future.result()
+    except Exception:
+        logging.exception('Site check of target %s failed', target.name)
+        return 2
+    missing = sorted(rel for rel in expected if rel not in on_disk)
+    orphaned = sorted(rel for rel in on_disk if rel not in expected)
+    broken = sorted({(rel, link) for rel, link in links if link not in on_disk})
+    for rel in missing:
+        print(f"missing\t{prefix}{rel}")
+    for rel in orphaned:
+        print(f"orphaned\t{prefix}{rel}")
+    for rel, reasons in sorted(stale):
+        print(f"stale\t{prefix}{rel}\t{'; '.join(reasons)}")
+    for rel, link in broken:
+        print(f"broken-link\t{prefix}{rel}\t{link}")
+    logging.info('Checked %s pages of %s (%s published) in %.1fs: %s missing, %s orphaned, %s stale, %s broken links',
+                 len(on_disk), target.name, len(expected), time.monotonic() - started, len(missing), len(orphaned), len(stale), len(broken))
+    if repair:
+        items = [expected[rel] + ('missing',) for rel in missing]
+        items += [expected[rel] + ('stale: ' + '; '.join(reasons),) for rel, reasons in stale if rel in expected]
+        for rel, link in broken:
+            if link in expected or link in reserved:
+                # the link is right, the page behind it is what's missing
+                items.append((expected.get(link) or reserved[link]) + ('link target missing',))
+            elif rel in expected:
+                items.append(expected[rel] + (f'broken link {link}',))
+        logging.info('Queued %s re-renders', queue_rerender(items))
+    return 1 if (missing or orphaned or stale or broken) else 0
+
+def drain_rerender_queue(limit: int = 20) -> int:
+    """
+    Re-render pages queued by `check --repair` through the normal publish path, within a budget of limit publishes.
+    - The old published rows stay until the page is written again for every target; only then are they
+      replaced, so a failed re-render (TMDB down, title gone) leaves the bookkeeping as it was.
+    - A failed entry waits RERENDER_RETRY_MINUTES (doubling per attempt) and is dropped after RERENDER_MAX_ATTEMPTS.
+    - Re-rendered pages count toward PUBLISHED_THIS_CYCLE like any other publish (main() passes what is left of
+      MAX_PUBLISH_PER_CYCLE).
+    """
+    now = datetime.now(timezone.utc)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute("SELECT imdb_id, season, episode, attempts FROM rerender_queue WHERE IFNULL(retry_after, '') <= ? ORDER BY rowid LIMIT ?",
+                            (now.isoformat(), max(0, limit))).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return 0
+    flush_bookkeeping()
+    by_title: Dict[str, List[Tuple[Optional[int], Optional[int], int]]] = {}
+    for imdb_id, sn, ep, attempts in rows:
+        by_title.setdefault(imdb_id, []).append((sn, ep, attempts or 0))
+    targets = {_target_key(t) for t in TARGETS}
+    done = 0
+    published_before = PUBLISHED_THIS_CYCLE
+    for imdb_id, items in by_title.items():
+        # a series root re-render also publishes missing episodes: stop once the budget is used up
+        if PUBLISHED_THIS_CYCLE - published_before >= limit:
+            break
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            for sn, ep, _ in items:
+                row = conn.execute('SELECT MAX(id) FROM published WHERE imdb_id=? AND IFNULL(season, -1)=? AND IFNULL(episode, -1)=?',
+                                   (imdb_id, -1 if sn is None else sn, -1 if ep is None else ep)).fetchone()
+                _RERENDER_AFTER[(imdb_id, sn, ep)] = row[0] or 0
+        finally:
+            conn.close()
+        for sn, ep, _ in items:
+            # an unchanged page keeps its sidecars (see _write_page_files); drop them so they are rebuilt
+            loc = url_lookup(imdb_id, sn, ep)
+            for target in (TARGETS if loc else ()):
+                for ext in _SIDECAR_COMPRESSORS:
+                    side_path = Path(target.site_dir) / f"{loc['rel_path']}.{ext}"
+                    if side_path.exists():
+                        side_path.unlink()
+        try:
+            if any(sn is None and ep is None for sn, ep, _ in items):
+                publish_imdb_item(imdb_id)
+            else:
+                # root is in place: only the listed episodes need their pages back
+                title = fetch_title(imdb_id)
+                if title is not None:
+                    publish_missing_episodes(title, None, only_seasons={sn for sn, _, _ in items}, batch_size=WRITE_BATCH_SIZE)
+        except Exception:
+            logging.exception('Re-render of %s failed', imdb_id)
+        try:
+            flush_bookkeeping()
+        finally:
+            after = {(sn, ep): _RERENDER_AFTER.pop((imdb_id, sn, ep), 0) for sn, ep, _ in items}
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            with conn:
+                for sn, ep, attempts in items:
+                    key = (imdb_id, -1 if sn is None else sn, -1 if ep is None else ep)
+                    written = {r[0] for r in conn.execute("SELECT DISTINCT IFNULL(target, '') FROM published WHERE imdb_id=? AND IFNULL(season, -1)=? AND IFNULL(episode, -1)=? AND id > ?",
+                                                          key + (after[(sn, ep)],))}
+                    # the new rows replace the old ones of the targets that were written again
+                    for t in written:
+                        conn.execute("DELETE FROM published WHERE imdb_id=? AND IFNULL(season, -1)=? AND IFNULL(episode, -1)=? AND id <= ? AND IFNULL(target, '')=?",
+                                     key + (after[(sn, ep)], t))
+                    if targets <= written:
+                        conn.execute('DELETE FROM rerender_queue WHERE imdb_id=? AND IFNULL(season, -1)=? AND IFNULL(episode, -1)=?', key)
+                        done += 1
+                    elif attempts + 1 >= RERENDER_MAX_ATTEMPTS:
+                        logging.warning('Giving up re-rendering %s S%sE%s after %s attempts', imdb_id, sn, ep, attempts + 1)
+                        conn.execute('DELETE FROM rerender_queue WHERE imdb_id=? AND IFNULL(season, -1)=? AND IFNULL(episode, -1)=?', key)
+                    else:
+                        retry_after = now + timedelta(minutes=RERENDER_RETRY_MINUTES * 2 ** attempts)
+                        conn.execute('UPDATE rerender_queue SET attempts=?, retry_after=? WHERE imdb_id=? AND IFNULL(season, -1)=? AND IFNULL(episode, -1)=?',
+                                     (attempts + 1, retry_after.isoformat()) + key)
+        finally:
+            conn.close()
+    logging.info('Re-rendered %s of %s queued pages', done, len(rows))
+    return done
+
+# ---------------------------
+# Reshard (`python main.py reshard`) and redirects for moved pages
+# ---------------------------
+# GitHub Pages serves 404.html for every unknown path; this one sends date-layout URLs to their shard
+# (or sharded URLs back to the date layout) using the same FNV-1a as slug_shard. Pages that really
+# don't exist land on a URL the script doesn't match, so it cannot loop.
+REDIRECT_404_TEMPLATE = r"""<!doctype html>
+<html lang="ar">
+<head>
+<meta charset="utf-8">
+<meta name="generator" content="publisher-redirects">
+<title>404</title>
+<script>
+(function () {
+  var base = {{ base_path|tojson }}, layout = {{ layout|tojson }}, p = location.pathname, m;
+  if (p.indexOf(base + '/') !== 0) return;
+  var rel = p.slice(base.length + 1), tail = location.search + location.hash;
+  if (layout === 'hash' && (m = /^(\d{4}\/\d{2})\/([^\/]+)\.html$/.exec(rel))) {
+    var bytes = new TextEncoder().encode(decodeURIComponent(m[2])), h = 0x811c9dc5;
+    for (var i = 0; i < bytes.length; i++) { h = Math.imul(h ^ bytes[i], 0x01000193) >>> 0; }
+    location.replace(base + '/' + m[1] + '/' + ('0' + (h & 255).toString(16)).slice(-2) + '/' + m[2] + '.html' + tail);
+  } else if (layout === 'date' && (m = /^(\d{4}\/\d{2})\/[0-9a-f]{2}\/([^\/]+\.html)$/.exec(rel))) {
+    location.replace(base + '/' + m[1] + '/' + m[2] + tail);
+  }
+})();
+</script>
+</head>
+<body><p>الصفحة غير موجودة</p></body>
+</html>
+"""
+
+def write_redirects(target: SiteTarget, db_path: str = DB_PATH) -> int:
+    """
+    Write the target's redirect files from url_redirects; returns the number of mapped URLs.
+    - redirects.map: one `old new;` line per moved page, for an nginx `map $uri $new_uri { include ...; }`.
+    - 404.html: the script above, written unless the site already has a 404.html of its own.
+    """
+    base_path = _site_base_path(target)
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute('SELECT old_path, new_path FROM url_redirects ORDER BY old_path').fetchall()
+    finally:
+        conn.close()
+    site = Path(target.site_dir)
+    lines = ''.join(f"{base_path}/{old} {base_path}/{new};\n" for old, new in rows)
+    _atomic_write_bytes(site / 'redirects.map', lines.encode('utf-8'))
+    page_404 = site / '404.html'
+    if page_404.exists() and b'publisher-redirects' not in page_404.read_bytes():
+        logging.warning('%s has its own 404.html; not replacing it with the redirect page.', target.name)
+    else:
+        _atomic_write_bytes(page_404, Template(REDIRECT_404_TEMPLATE).render(base_path=base_path, layout=SITE_LAYOUT).encode('utf-8'))
+    return len(rows)
+
+def _move_page(site_dir: str, old: str, new: str) -> bool:
+    """Rename a page and its sidecars; False when the page is in neither place. Safe to repeat."""
+    src, dst = Path(site_dir) / old, Path(site_dir) / new
+    if not src.exists():
+        return dst.exists()
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    for ext in _SIDECAR_COMPRESSORS:
+        side = src.with_name(f"{src.name}.{ext}")
+        if side.exists():
+            os.replace(side, dst.with_name(f"{dst.name}.{ext}"))
+    os.replace(src, dst)
+    try:
+        src.parent.rmdir()  # drops emptied shard directories
+    except OSError:
+        pass
+    return True
+
+def _rewrite_links(site_dir: str, rel: str, base_path: str, moves: Dict[str, str]) -> Optional[bytes]:
+    """The page with links to moved pages pointing at their new location; None when it has none."""
+    html = (Path(site_dir) / rel).read_text(encoding='utf-8')
+    prefix = f"{base_path}/"
+
+    def repl(m):
+        href = m.group(1)
+        if href.startswith(prefix) and href[len(prefix):] in moves:
+            return f'href="{prefix}{moves[href[len(prefix):]]}"'
+        return m.group(0)
+
+    updated = _HREF_RE.sub(repl, html)
+    return updated.encode('utf-8') if updated != html else None
+
+def run_reshard() -> int:
+    """
+    Move every indexed page of every target to its SITE_LAYOUT location, in place.
+    - Pages and sidecars are renamed, then links to moved pages are rewritten in every page, so
+      internal navigation skips the redirects. Pages are read on a thread pool (CHECK_WORKERS) and
+      written back in PageBatch group commits.
+    - url_index, published urls and url_redirects are updated last, in one transaction; an
+      interrupted run is finished by running it again (moves and rewrites are idempotent).
+    - Each target then gets redirects.map / 404.html for the old URLs and a rebuilt search index,
+      and is committed and pushed.
+    Exit code: 0 done, 2 failed.
+    """
+    init_db()
+    backfill_url_index()
+    for target in TARGETS:
+        recover_page_batches(target.site_dir)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute('SELECT rel_path, imdb_id, season, episode FROM url_index').fetchall()
+    finally:
+        conn.close()
+    moves = {rel: relayout_rel_path(rel) for rel, _, _, _ in rows}
+    moves = {old: new for old, new in moves.items() if new != old}
+    logging.info('Resharding to the %s layout: %s of %s indexed pages move', SITE_LAYOUT, len(moves), len(rows))
+    try:
+        for target in TARGETS:
+            if not os.path.isdir(target.site_dir):
+                continue
+            started = time.monotonic()
+            absent = sum(1 for old, new in moves.items() if not _move_page(target.site_dir, old, new))
+            base_path = _site_base_path(target)
+            rel_paths = list(_iter_site_pages(target.site_dir))
+            batch = PageBatch(target.site_dir)  # sidecars are rewritten with the pages
+            rewritten = 0
+            with ThreadPoolExecutor(max_workers=max(1, CHECK_WORKERS)) as pool:
+                for rel, updated in zip(rel_paths, pool.map(lambda rel: _rewrite_links(target.site_dir, rel, base_path, moves), rel_paths)):
+                    if updated is None:
+                        continue
+                    batch.add(rel, updated)
+                    rewritten += 1
+                    if len(batch) >= WRITE_BATCH_SIZE:
+                        batch.commit()
+            batch.commit()
+            logging.info('%s: moved %s pages (%s not on disk), rewrote links in %s pages in %.1fs',
+                         target.name, len(moves) - absent, absent, rewritten, time.monotonic() - started)
+        now = datetime.now(timezone.utc).isoformat()
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            with conn:
+                for rel, imdb_id, sn, ep in rows:
+                    if rel not in moves:
+                        continue
+                    new = moves[rel]
+                    key = (imdb_id, -1 if sn is None else sn, -1 if ep is None else ep)
+                    conn.execute('UPDATE url_index SET rel_path=?, url=? WHERE rel_path=?', (new, _page_url(new, TARGETS[0]), rel))
+                    for target in TARGETS:
+                        conn.execute("UPDATE published SET url=? WHERE imdb_id=? AND IFNULL(season, -1)=? AND IFNULL(episode, -1)=? AND IFNULL(target, '')=?",
+                                     (_page_url(new, target),) + key + (_target_key(target),))
+                    # follow earlier moves so every old URL points straight at the current location
+                    conn.execute('UPDATE url_redirects SET new_path=?, moved_at=? WHERE new_path=?', (new, now, rel))
+                    conn.execute('INSERT OR REPLACE INTO url_redirects (old_path, new_path, moved_at) VALUES (?, ?, ?)', (rel, new, now))
+                conn.execute('DELETE FROM url_redirects WHERE old_path = new_path')
+        finally:
+            conn.close()
+        for target in TARGETS:
+            if not os.path.isdir(target.site_dir):
+                continue
+            logging.info('%s: %s redirects written', target.name, write_redirects(target))
+            rebuild_search_index(target.site_dir, target=target)  # search docs carry page urls
+            _git_commit_and_push(target.site_dir, f"Reshard pages to the {SITE_LAYOUT} layout by {AUTHOR_NAME}", target.git_remote)
+    except Exception:
+        logging.exception('Reshard failed; run it again to finish')
+        return 2
+    return 0
+
 # ---------------------------
 # Main loop (reads file-based queue)
 # ---------------------------
 def main():
+    if DRY_RUN:
+        logging.info('DRY RUN: shadow state in %s (live SITE_DIR, databases and queue file are not written)', DRY_RUN_DIR)
+    dry_run_started = time.monotonic()
     init_db()
-    RUN_FOREVER = os.environ.get('RUN_FOREVER', '1') == '1'
+    for target in TARGETS:
+        try:
+            recover_page_batches(target.site_dir)
+        except Exception:
+            logging.exception('Failed to recover interrupted page batches of target %s', target.name)
+    try:
+        reconcile_bookkeeping()
+    except Exception:
+        logging.exception('Failed to reconcile bookkeeping stores')
+    try:
+        backfill_url_index()
+    except Exception:
+        logging.exception('Failed to backfill url_index')
+    for target in TARGETS:
+        if not search_index_current(target.site_dir):
+            try:
+                rebuild_search_index(target.site_dir, target=target)
+            except Exception:
+                logging.exception('Failed to build search index of target %s', target.name)
+    RUN_FOREVER = os.environ.get('RUN_FOREVER', '1') == '1' and not DRY_RUN
     CYCLE_SLEEP = int(os.environ.get('CYCLE_SLEEP', '600'))
     MAX_PUBLISH_PER_CYCLE = int(os.environ.get('MAX_PUBLISH_PER_CYCLE', '20'))
 
@@ -1061,74 +3727,90 @@ def main():
             global PUBLISHED_THIS_CYCLE
             PUBLISHED_THIS_CYCLE = 0
 
+            for pending_id in journal_pending():
+                try:
+                    publish_imdb_item(pending_id, season=None, episode=None, is_dry_run=DRY_RUN)
+                except Exception:
+                    logging.exception('Failed to resume journaled publish of %s', pending_id)
+
+            if REFRESH_ONGOING:
+                try:
+                    refresh_ongoing_series()
+                except Exception:
+                    logging.exception('Ongoing series refresh failed.')
+            try:
+                release_due_episodes()
+            except Exception:
+                logging.exception('Releasing scheduled episodes failed.')
+            if DISCOVER:
+                try:
+                    discover_new_titles()
+                except Exception:
+                    logging.exception('Discovery run failed.')
+            try:
+                drain_rerender_queue(MAX_PUBLISH_PER_CYCLE - PUBLISHED_THIS_CYCLE)
+            except Exception:
+                logging.exception('Draining the re-render queue failed.')
+
             any_ids_found = False
             stop_processing = False
 
-            for chunk in iter_imdb_queue(IMDB_FILE, chunk_size=CHUNK_SIZE):
-                if stop_processing:
-                    break
-
+            for chunk, consumed in iter_imdb_queue(IMDB_FILE, chunk_size=CHUNK_SIZE):
                 any_ids_found = True
                 queue = [{'imdb_id': iid, 'type': 'movie', 'season': None, 'episode': None} for iid in chunk]
+                handled = 0
 
                 for item in queue:
                     if PUBLISHED_THIS_CYCLE >= MAX_PUBLISH_PER_CYCLE:
                         logging.info('Reached MAX_PUBLISH_PER_CYCLE (%s) during this cycle. Stopping processing queue.', MAX_PUBLISH_PER_CYCLE)
                         stop_processing = True
                         break
+                    handled += 1
 
                     imdb_id = item.get('imdb_id')
 
+                    # published rows, imdb_queue status and file removals are committed together
+                    # (see flush_bookkeeping), so the published table alone is authoritative here
                     try:
                         if db_has(imdb_id, None, None):
                             logging.info('Found %s already in published table -> removing from file and skipping.', imdb_id)
-                            try:
-                                removed = remove_imdb_ids_from_txt([imdb_id], IMDB_FILE)
-                                logging.info('Removed %s entries from file for %s', removed, imdb_id)
-                            except Exception:
-                                logging.exception('Failed to remove imdb id from file for %s after found in published table', imdb_id)
+                            queue_remove(imdb_id)
                             continue
                     except Exception:
                         logging.exception('Error while checking published table for %s', imdb_id)
 
                     try:
-                        if imdb_queue_is_published(imdb_id):
-                            logging.info('Found %s marked published in imdb_queue DB -> removing from file and skipping.', imdb_id)
-                            try:
-                                removed = remove_imdb_ids_from_txt([imdb_id], IMDB_FILE)
-                                logging.info('Removed %s entries from file for %s (imdb_queue published)', removed, imdb_id)
-                            except Exception:
-                                logging.exception('Failed to remove imdb id from file for %s after imdb_queue reported published', imdb_id)
-                            continue
-                    except Exception:
-                        logging.exception('Failed checking imdb_queue publish status for %s', imdb_id)
-
-                    try:
-                        ok = publish_imdb_item(imdb_id, season=None, episode=None, is_dry_run=False)
-                        if ok:
-                            try:
-                                removed = remove_imdb_ids_from_txt([imdb_id], IMDB_FILE)
-                                logging.info('Published and removed %s from file (removed=%s)', imdb_id, removed)
-                            except Exception:
-                                logging.exception('Failed to remove imdb id from file after publish %s', imdb_id)
-                        else:
+                        ok = publish_imdb_item(imdb_id, season=None, episode=None, is_dry_run=DRY_RUN)
+                        if not ok:
                             logging.info('Skipped or failed to publish %s (ok=%s)', imdb_id, ok)
                     except Exception:
                         logging.exception('Failed publish from file queue %s', imdb_id)
 
+                if stop_processing:
+                    # leave without resuming the generator, which would move the cursor past the whole chunk
+                    consumed(handled)
+                    break
+
             if not any_ids_found:
                 logging.info('No imdb ids found in %s this cycle.', IMDB_FILE)
 
+            flush_bookkeeping()
             published_count = PUBLISHED_THIS_CYCLE
             logging.info('Cycle completed. Published %s items this cycle.', published_count)
 
         except Exception:
             logging.exception('Unexpected error in file-based publish cycle.')
+            try:
+                flush_bookkeeping()
+            except Exception:
+                logging.exception('Failed to flush bookkeeping after cycle error.')
             try:
                 published_count = PUBLISHED_THIS_CYCLE
             except Exception:
                 published_count = 0
 
+        if DRY_RUN:
+            logging.info('DRY RUN report (shadow tree: %s):\n%s', DRY_RUN_DIR, stage_report(published_count, time.monotonic() - dry_run_started))
         if not RUN_FOREVER:
             break
 
@@ -1139,5 +3821,19 @@ def main():
             logging.info('Published %s items (< %s). Continuing next cycle immediately.', published_count, MAX_PUBLISH_PER_CYCLE)
             time.sleep(0.5)
 
-if __name__ == '__main__':
+def cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Publish TMDB titles from the IMDb queue as static pages.')
+    sub = parser.add_subparsers(dest='command')
+    check = sub.add_parser('check', help='verify published pages against every target site dir (exit 0 clean, 1 problems, 2 error)')
+    check.add_argument('--repair', action='store_true', help='queue re-renders of missing, stale and broken-link pages')
+    sub.add_parser('reshard', help='move existing pages to the SITE_LAYOUT layout and write redirects for their old URLs')
+    args = parser.parse_args(argv)
+    if args.command == 'check':
+        return run_check(repair=args.repair)
+    if args.command == 'reshard':
+        return run_reshard()
     main()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(cli())